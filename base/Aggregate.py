@@ -0,0 +1,83 @@
+# Odoo style read_group aggregates computed while the pages of a search
+# stream in: every item is folded into the accumulators of its group and
+# dropped, so memory grows with the number of groups, never with the items.
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+
+
+def parse_fields(fields):
+    # 'amount:sum', 'total:sum(amount)' or 'amount' (summed) ->
+    # [(name in the result, aggregate, field)]
+    specs = []
+    for spec in fields or []:
+        name, _, aggregate = spec.partition(':')
+        field = name
+        if '(' in aggregate:
+            aggregate, _, field = aggregate.rstrip(')').partition('(')
+        aggregate = aggregate or 'sum'
+        if aggregate not in AGGREGATES:
+            raise Exception(f'Unknown aggregate {aggregate}, use one of {", ".join(AGGREGATES)}')
+        specs.append((name, aggregate, field))
+    return specs
+
+
+class Groups:
+    def __init__(self, groupby, specs):
+        self.groupby = groupby
+        self.specs = specs
+        # group values -> [items, [values, accumulated] per spec]
+        self.groups = {}
+
+    def _group(self, key):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0] + [[0, None] for _ in self.specs]
+        return group
+
+    def add(self, items):
+        for item in items:
+            group = self._group(tuple(item.get(field) for field in self.groupby))
+            group[0] += 1
+            for accumulator, (_, aggregate, field) in zip(group[1:], self.specs):
+                value = item.get(field)
+                if value is None:
+                    # like SQL, missing attributes are left out
+                    continue
+                current = accumulator[1]
+                accumulator[0] += 1
+                if current is None or aggregate == 'count':
+                    accumulator[1] = value
+                elif aggregate in ('sum', 'avg'):
+                    accumulator[1] = current + value
+                elif aggregate == 'min':
+                    accumulator[1] = min(current, value)
+                elif aggregate == 'max':
+                    accumulator[1] = max(current, value)
+
+    def rows(self, orderby=None, offset=0, limit=None):
+        if not self.groupby:
+            # totals of the whole domain, even when nothing matches
+            self._group(())
+        rows = []
+        for key, (count, *accumulators) in self.groups.items():
+            row = dict(zip(self.groupby, key))
+            row['__count'] = count
+            for (name, aggregate, _), (values, value) in zip(self.specs, accumulators):
+                if aggregate == 'count':
+                    row[name] = values
+                elif aggregate == 'avg':
+                    row[name] = value / values if values else None
+                else:
+                    row[name] = value
+            rows.append(row)
+        # 'field', 'field desc' or several of them separated by commas, by
+        # default the groupby fields, missing values after the others
+        for term in reversed((orderby or ', '.join(self.groupby)).split(',')):
+            if not term.strip():
+                continue
+            field, _, direction = term.strip().partition(' ')
+            rows.sort(
+                key=lambda row: (row.get(field) is None, row.get(field)),
+                reverse=direction.strip().lower() == 'desc',
+            )
+        return rows[offset:offset + limit if limit else None]
@@ -0,0 +1,59 @@
+import contextvars
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# boto3 has no asyncio transport, so async calls run the synchronous code on
+# a shared thread pool. Every model bounds how many of its calls may be in
+# flight at once with a semaphore per event loop. asyncio is imported on
+# first use to keep it out of the import time of synchronous handlers.
+MAX_WORKERS = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='serverlessORM')
+    return _executor
+
+
+def semaphore(model):
+    import asyncio
+
+    # asyncio primitives belong to one loop and Lambda handlers commonly
+    # start a new loop per invocation, hence one semaphore per loop
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if model._name not in semaphores:
+        semaphores[model._name] = asyncio.Semaphore(model._async_concurrency)
+    return semaphores[model._name]
+
+
+async def run(model, function, *args, **kwargs):
+    import asyncio
+
+    async with semaphore(model):
+        # copy the context so scope() and other context variables carry over
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor(), partial(context.run, function, *args, **kwargs)
+        )
+
+
+async def iterate(model, generator):
+    # drives a synchronous generator from the thread pool, one item per step
+    done = object()
+    try:
+        while True:
+            item = await run(model, next, generator, done)
+            if item is done:
+                return
+            yield item
+    finally:
+        generator.close()
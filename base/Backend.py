@@ -0,0 +1,252 @@
+from base.Batch import (
+    TRANSACT_WRITE_SIZE, batch_get, batch_write, batch_writer, merge_pages, paginate, parallel, parallel_pages,
+    parallel_scan,
+)
+from base.Domain import fields_of
+from base.Registry import registry
+
+# The storage behind Model. A backend resolves a model's schema and runs the
+# requests the ORM needs on items (dicts of python values): put, get, batch
+# writes, partial updates, and searches executed from a Domain plan. Models
+# use DynamoDB unless their `_backend` is set, e.g. to a MemoryBackend.
+
+
+def projected(items, fields):
+    # only the fields and the id of items, like a ProjectionExpression
+    if not fields:
+        return items
+    needed = set(fields) | {'id'}
+    return [{key: value for key, value in item.items() if key in needed} for item in items]
+
+
+class Backend:
+    def schema(self, model):
+        # the model's Schema, created or migrated as the backend sees fit
+        raise NotImplementedError
+
+    def migrate(self, model):
+        return self.schema(model)
+
+    def put(self, model, item):
+        raise NotImplementedError
+
+    def batch(self, model, puts=(), deletes=()):
+        # puts are items, deletes are ids
+        raise NotImplementedError
+
+    def get(self, model, ids, fields=None):
+        # the existing items among ids, in any order, with only `fields` and
+        # the id when given
+        raise NotImplementedError
+
+    def update(self, model, ID, values, returning=False):
+        # Sets the given attributes of an existing item, None values remove
+        # the attribute. Returns the updated attributes when `returning`.
+        raise NotImplementedError
+
+    def search(self, model, searchPlan, fields=None, limit=None, segments=1, max_workers=8, start=None):
+        # yields pages of the items matching the plan's key condition and
+        # pushed down filter, the residual is left to the caller. `start` is
+        # the key of the item to resume after.
+        raise NotImplementedError
+
+    def count(self, model, searchPlan, segments=1, max_workers=8):
+        # the number of items matching the plan's key condition and pushed
+        # down filter
+        return sum(len(items) for items in self.search(model, searchPlan, ['id'], None, segments, max_workers))
+
+    def commit(self, changes, atomic=False):
+        # Applies (model, kind, payload) changes of a unit of work: 'put' an
+        # item, 'update' an id with values or 'delete' an id.
+        if atomic:
+            raise NotImplementedError(f'{type(self).__name__} has no atomic commits')
+        for model, kind, payload in changes:
+            if kind == 'put':
+                self.put(model, payload)
+            elif kind == 'update':
+                self.update(model, payload['id'], payload)
+            else:
+                self.batch(model, deletes=[payload])
+
+
+class DynamoBackend(Backend):
+    def schema(self, model):
+        return registry.resolve(model)
+
+    def migrate(self, model):
+        return registry.migrate(model)[0]
+
+    def put(self, model, item):
+        model._client().put_item(TableName=self.schema(model).name, Item=item)
+
+    def batch(self, model, puts=(), deletes=()):
+        with batch_writer(self.schema(model).name, model._client()) as batch:
+            for item in puts:
+                batch.put_item(Item=item)
+            for ID in deletes:
+                batch.delete_item(Key={'id': ID})
+
+    def get(self, model, ids, fields=None):
+        # duplicate keys are rejected by batch_get_item
+        Keys = list(map(lambda ID: {'id': ID}, dict.fromkeys(ids)))
+        return batch_get(
+            model._name, Keys, model._batch_retries, model._max_workers, model._client(), **self._projection(fields)
+        )
+
+    def update(self, model, ID, values, returning=False):
+        response = model._client().update_item(
+            TableName=self.schema(model).name,
+            ReturnValues='UPDATED_NEW' if returning else 'NONE',
+            **self._update_params(ID, values)
+        )
+        return response.get('Attributes', {})
+
+    def _update_params(self, ID, values):
+        ExpressionAttributeNames = {'#id': 'id'}
+        ExpressionAttributeValues = {}
+        SET = []
+        REMOVE = []
+        for index, (key, value) in enumerate(values.items()):
+            if key == 'id':
+                continue
+            ExpressionAttributeNames[f'#k{index}'] = key
+            if value is None:
+                REMOVE.append(f'#k{index}')
+            else:
+                ExpressionAttributeValues[f':v{index}'] = value
+                SET.append(f'#k{index} = :v{index}')
+        UpdateExpression = f'SET {", ".join(SET)}'
+        if REMOVE:
+            UpdateExpression += f' REMOVE {", ".join(REMOVE)}'
+        return {
+            'Key': {'id': ID},
+            'UpdateExpression': UpdateExpression,
+            # never turn an update into an insert of a partial item
+            'ConditionExpression': 'attribute_exists(#id)',
+            'ExpressionAttributeNames': ExpressionAttributeNames,
+            'ExpressionAttributeValues': ExpressionAttributeValues,
+        }
+
+    def commit(self, changes, atomic=False):
+        if atomic:
+            if len(changes) > TRANSACT_WRITE_SIZE:
+                raise Exception(f'A transaction takes at most {TRANSACT_WRITE_SIZE} changes, got {len(changes)}')
+            TransactItems = []
+            for model, kind, payload in changes:
+                TableName = self.schema(model).name
+                if kind == 'put':
+                    TransactItems.append({'Put': {'TableName': TableName, 'Item': payload}})
+                elif kind == 'update':
+                    TransactItems.append({
+                        'Update': dict(self._update_params(payload['id'], payload), TableName=TableName)
+                    })
+                else:
+                    TransactItems.append({'Delete': {'TableName': TableName, 'Key': {'id': payload}}})
+            changes[0][0]._client().transact_write_items(TransactItems=TransactItems)
+            return
+        # puts and deletes of every table share BatchWriteItem requests, which
+        # can't do partial updates, those are sent as UpdateItem in parallel
+        first = changes[0][0]
+        batch_write(
+            [
+                (self.schema(model).name, {'PutRequest': {'Item': payload}} if kind == 'put' else
+                 {'DeleteRequest': {'Key': {'id': payload}}})
+                for model, kind, payload in changes if kind != 'update'
+            ],
+            first._client(), first._batch_retries, first._max_workers,
+        )
+        parallel(
+            lambda change: self.update(change[0], change[2]['id'], change[2]),
+            [change for change in changes if change[1] == 'update'],
+            first._max_workers,
+        )
+
+    def count(self, model, searchPlan, segments=1, max_workers=8):
+        if searchPlan.kind == 'get':
+            return super().count(model, searchPlan, segments, max_workers)
+        method, params = self._request(model, searchPlan)
+        # only the number of matching items comes back, at the read cost of
+        # the items evaluated
+        params['Select'] = 'COUNT'
+        if searchPlan.shards:
+            return sum(parallel_pages(method, self._shard_requests(searchPlan, params), max_workers, 'Count'))
+        if searchPlan.kind == 'scan' and segments > 1:
+            return sum(parallel_scan(method, params, segments, max_workers, 'Count'))
+        return sum(paginate(method, params, field='Count'))
+
+    def search(self, model, searchPlan, fields=None, limit=None, segments=1, max_workers=8, start=None):
+        method, params = self._request(model, searchPlan, fields)
+        if start and searchPlan.kind == 'get':
+            ids = [key['id'] for key in params['Keys']]
+            params['Keys'] = params['Keys'][ids.index(start['id']) + 1:] if start.get('id') in ids else params['Keys']
+        elif start:
+            params['ExclusiveStartKey'] = start
+        if searchPlan.kind == 'scan' and segments > 1:
+            # every segment paginates on its own thread, pages arrive in
+            # whatever order the segments produce them
+            return parallel_scan(method, params, segments, max_workers)
+        # with a filter, Limit would count evaluated rather than matched
+        # items, and batch_get_item takes no Limit at all
+        unbounded = searchPlan.kind == 'get' or searchPlan.filter or searchPlan.residual
+        if searchPlan.shards:
+            # scatter-gather over the shards of the index, merged on the
+            # range key when the results are ordered
+            requests = self._shard_requests(searchPlan, params)
+            if searchPlan.order:
+                return merge_pages(
+                    [paginate(method, request, None if unbounded else limit) for request in requests],
+                    searchPlan.order, not searchPlan.forward,
+                )
+            return parallel_pages(method, requests, max_workers, limit=None if unbounded else limit)
+        return paginate(method, params, None if unbounded else limit)
+
+    def _shard_requests(self, searchPlan, params):
+        return [
+            dict(params, ExpressionAttributeValues=dict(params['ExpressionAttributeValues'], **shard))
+            for shard in searchPlan.shards
+        ]
+
+    def _projection(self, fields=None, searchPlan=None):
+        # the ProjectionExpression of the requested fields, the id and the
+        # fields evaluated in memory, without touching the caller's list
+        if not fields:
+            return {}
+        residual = fields_of(searchPlan.residual) if searchPlan else []
+        names = list(dict.fromkeys(list(fields) + ['id'] + residual))
+        ExpressionAttributeNames = {f'#p{index}': name for index, name in enumerate(names)}
+        return {
+            'ProjectionExpression': ', '.join(ExpressionAttributeNames),
+            'ExpressionAttributeNames': ExpressionAttributeNames,
+        }
+
+    def _request(self, model, searchPlan, fields=None):
+        # the client method and parameters executing the plan
+        client = model._client()
+        TableName = model._name
+        if searchPlan.fetch:
+            # the items are fetched again from the table, the index only has
+            # to return their keys
+            projection = self._projection(self.schema(model).indexes[searchPlan.index]['keys'].values())
+        else:
+            projection = self._projection(fields, searchPlan)
+
+        params = dict(searchPlan.params(), TableName=TableName)
+        if searchPlan.kind == 'get':
+            def get(TableName, Keys):
+                items = batch_get(TableName, Keys, model._batch_retries, model._max_workers, client, **projection)
+                # batch_get_item returns the items in any order, a cursor
+                # resumes after the last one in Keys order
+                position = {key['id']: index for index, key in enumerate(Keys)}
+                return {'Items': sorted(items, key=lambda item: position[item['id']])}
+
+            params['Keys'] = list(map(lambda ID: {'id': ID}, searchPlan.keys))
+            return get, params
+        if projection:
+            params['ProjectionExpression'] = projection['ProjectionExpression']
+            params['ExpressionAttributeNames'] = dict(
+                params.get('ExpressionAttributeNames', {}), **projection['ExpressionAttributeNames']
+            )
+        return client.scan if searchPlan.kind == 'scan' else client.query, params
+
+
+dynamodb = DynamoBackend()
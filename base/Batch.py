@@ -0,0 +1,220 @@
+import contextvars
+import heapq
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dynamo
+
+# DynamoDB request limits
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+TRANSACT_WRITE_SIZE = 100
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def backoff(attempt, base=0.05, cap=5):
+    # exponential backoff with full jitter
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+
+def batch_writer(TableName, client=None):
+    # a BatchWriter of our own over a thread safe client rather than the
+    # shared Table resource
+    from boto3.dynamodb.table import BatchWriter
+
+    return BatchWriter(TableName, client or dynamo.resource.meta.client)
+
+
+def batch_write(requests, client=None, retries=8, max_workers=8):
+    # Sends (TableName, PutRequest or DeleteRequest) pairs of any tables in
+    # BATCH_WRITE_SIZE BatchWriteItem requests, retrying UnprocessedItems.
+    client = client or dynamo.resource.meta.client
+
+    def write(chunk):
+        RequestItems = {}
+        for TableName, request in chunk:
+            RequestItems.setdefault(TableName, []).append(request)
+        for attempt in range(retries + 1):
+            RequestItems = client.batch_write_item(RequestItems=RequestItems).get('UnprocessedItems')
+            if not RequestItems:
+                return
+            backoff(attempt)
+        raise Exception(f'{sum(map(len, RequestItems.values()))} items still unprocessed after {retries} retries')
+
+    parallel(write, list(chunks(requests, BATCH_WRITE_SIZE)), max_workers)
+
+
+def parallel(function, items, max_workers=8):
+    # map function over items on a bounded thread pool, keeping the order.
+    # Workers run in a copy of the caller's context (e.g. its metrics call).
+    if len(items) < 2:
+        return list(map(function, items))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, function, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def batch_get(name, keys, retries=8, max_workers=8, client=None, **params):
+    # Fetches any number of keys in BATCH_GET_SIZE chunks on a bounded thread
+    # pool, retrying UnprocessedKeys. A client is used because, unlike the
+    # resource, it is thread safe.
+    client = client or dynamo.resource.meta.client
+
+    def fetch(chunk):
+        items = []
+        RequestItems = {name: dict(params, Keys=chunk)}
+        for attempt in range(retries + 1):
+            response = client.batch_get_item(RequestItems=RequestItems)
+            items += response.get('Responses', {}).get(name, [])
+            RequestItems = response.get('UnprocessedKeys')
+            if not RequestItems:
+                return items
+            backoff(attempt)
+        raise Exception(f'{len(RequestItems[name]["Keys"])} keys still unprocessed after {retries} retries')
+
+    batches = list(chunks(keys, BATCH_GET_SIZE))
+    return [item for items in parallel(fetch, batches, max_workers) for item in items]
+
+
+def paginate(method, params, limit=None, field='Items'):
+    # follows LastEvaluatedKey, yielding the items (or the `field`, e.g.
+    # 'Count') of one response at a time. `limit` caps the number of items
+    # DynamoDB evaluates in total.
+    params = dict(params)
+    remaining = limit
+    while True:
+        if remaining:
+            params['Limit'] = remaining
+        response = method(**params)
+        items = response.get(field, [])
+        yield items
+        if remaining:
+            remaining -= len(items)
+            if remaining <= 0:
+                return
+        ExclusiveStartKey = response.get('LastEvaluatedKey')
+        if not ExclusiveStartKey:
+            return
+        params['ExclusiveStartKey'] = ExclusiveStartKey
+
+
+def parallel_scan(scan, params, segments, max_workers=8, field='Items'):
+    # Runs a Scan split into `segments` Segment/TotalSegments slices, each one
+    # paginating on its own worker thread.
+    requests = [dict(params, Segment=segment, TotalSegments=segments) for segment in range(segments)]
+    return parallel_pages(scan, requests, max_workers, field)
+
+
+def parallel_pages(method, requests, max_workers=8, field='Items', limit=None):
+    # Paginates every request on its own worker thread and yields their pages
+    # from a shared bounded queue, in whatever order they arrive. Closing the
+    # generator stops the remaining workers.
+    pages = queue.Queue(maxsize=max_workers * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def worker(request):
+        try:
+            for page in paginate(method, request, limit, field):
+                if stop.is_set():
+                    break
+                put(page)
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests))))
+    for request in requests:
+        executor.submit(contextvars.copy_context().run, worker, request)
+    try:
+        running = len(requests)
+        while running:
+            page = pages.get()
+            if page is done:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            elif page:
+                yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def prefetch(stream, stop, size=2):
+    # Starts pulling the pages of `stream` on a worker thread into a bounded
+    # queue of `size` pages, so a consumer busy with other streams doesn't
+    # hold it back, and returns them as a generator. Setting `stop` ends the
+    # worker.
+    pages = queue.Queue(maxsize=size)
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def worker():
+        try:
+            for page in stream:
+                if stop.is_set():
+                    break
+                put(page)
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    def read():
+        while True:
+            page = pages.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+
+    threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
+    return read()
+
+
+def merge_pages(streams, key, reverse=False, size=1000):
+    # Merges page streams that are each sorted on `key` into pages of `size`
+    # items sorted the same way. Every stream is fetched ahead on its own
+    # thread, a bounded number of pages at a time.
+    stop = threading.Event()
+    streams = [prefetch(stream, stop) for stream in streams]
+    try:
+        items = heapq.merge(
+            *[(item for page in stream for item in page) for stream in streams],
+            key=lambda item: item.get(key), reverse=reverse,
+        )
+        page = []
+        for item in items:
+            page.append(item)
+            if len(page) == size:
+                yield page
+                page = []
+        if page:
+            yield page
+    finally:
+        stop.set()
@@ -0,0 +1,207 @@
+import base64
+import contextvars
+import csv
+import gzip
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from decimal import Decimal
+
+from base.Changes import BUCKET, TIMESTAMPS, bucket_values
+from base.Compress import pack_values, unpack_values
+from base.Shard import attribute, shard_values, sharded
+
+# Streaming import and export of whole tables as JSONL or CSV files (gzipped
+# when the name ends with .gz). Import validates each distinct set of columns
+# once and writes chunks on parallel batch writers with a bounded number in
+# flight, export streams the pages of a parallel segmented scan to the file,
+# so neither holds more than a few pages in memory.
+
+# field types written as text in CSV cells
+TYPED = ('M', 'L', 'SS', 'NS', 'BS', 'B', 'BOOL')
+# items per batch writer task, and default Scan segments of an export
+IMPORT_CHUNK = 500
+EXPORT_SEGMENTS = 8
+
+
+def _format(path, format=None):
+    if format:
+        return format
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    raise Exception(f'Unknown format of {path}, pass format="jsonl" or "csv"')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', newline='' if mode == 'w' else None, encoding='utf-8')
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def _json(value):
+    # json.dumps default= for the types DynamoDB returns
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _cell(value):
+    # CSV cells are text: binaries are written as base64, other non scalar
+    # values (maps, lists, sets, booleans) as JSON
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    if value is None or isinstance(value, (str, int, float, Decimal)) and not isinstance(value, bool):
+        return value
+    return json.dumps(value, default=_json)
+
+
+def _typed(kind, value):
+    # a value read back from a file as its field's type, the reverse of
+    # _cell() and _json()
+    if isinstance(value, str):
+        if kind == 'B':
+            return base64.b64decode(value)
+        value = json.loads(value, parse_float=Decimal)
+    if kind in ('SS', 'NS', 'BS') and isinstance(value, list):
+        if kind == 'NS':
+            return {Decimal(str(item)) for item in value}
+        if kind == 'BS':
+            return {base64.b64decode(item) for item in value}
+        return set(value)
+    return value
+
+
+def read_items(source, format=None):
+    # items of a JSONL/CSV file, or of any iterable of dicts
+    if not isinstance(source, str):
+        yield from source
+        return
+    format = _format(source, format)
+    with _open(source, 'r') as file:
+        if format == 'csv':
+            for row in csv.DictReader(file):
+                # empty cells are missing attributes
+                yield {key: value for key, value in row.items() if value not in ('', None)}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line, parse_float=Decimal)
+
+
+class Validator:
+    # checks items against the model's fields, once per distinct set of keys
+    def __init__(self, model, defaultFields):
+        self.allowed = set(defaultFields) | {field.get('name') for field in model._fields or []}
+        # exported shard keys are recomputed
+        self.allowed |= {attribute(name) for name in sharded(model._fields)} | {BUCKET}
+        # CSV cells are strings, numbers (timestamps included) are converted
+        # to Decimal
+        self.numbers = {field.get('name') for field in model._fields or [] if field.get('type') == 'N'}
+        self.numbers |= set(TIMESTAMPS)
+        # maps, lists, sets, binaries and booleans are text in CSV cells and
+        # binaries base64 in JSONL
+        self.typed = {
+            field.get('name'): field.get('type') for field in model._fields or []
+            if field.get('type') in TYPED
+        }
+        self._checked = set()
+
+    def __call__(self, item):
+        keys = frozenset(item)
+        if keys not in self._checked:
+            invalid = keys - self.allowed
+            if invalid:
+                raise Exception(f'Invalid field {sorted(invalid)[0]}')
+            self._checked.add(keys)
+        for name in self.numbers & keys:
+            if isinstance(item[name], (str, int, float)) and not isinstance(item[name], bool):
+                item[name] = Decimal(str(item[name]))
+        for name in self.typed.keys() & keys:
+            if isinstance(item[name], (str, list)):
+                try:
+                    item[name] = _typed(self.typed[name], item[name])
+                except ValueError:
+                    raise Exception(f'Invalid {self.typed[name]} value for {name}: {item[name]!r}')
+        return item
+
+
+def import_items(model, items, defaultFields, timestamp, max_workers=8):
+    # Writes items with up to max_workers parallel batch writers, keeping at
+    # most twice as many chunks in flight. Items keep their id when they have
+    # one. Returns the number of items written.
+    validate = Validator(model, defaultFields)
+    store = model._store()
+    inFlight = threading.BoundedSemaphore(max_workers * 2)
+    futures = []
+    count = 0
+
+    def write(chunk):
+        try:
+            store.batch(model, puts=chunk)
+        finally:
+            inFlight.release()
+
+    def prepared():
+        for item in items:
+            item = validate(dict(item))
+            item.setdefault('id', str(uuid.uuid4()))
+            shard_values(model, item)
+            item.setdefault('createdAt', timestamp)
+            item.setdefault('updatedAt', timestamp)
+            bucket_values(model, item)
+            yield pack_values(model, item)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk in chunks_of(prepared(), IMPORT_CHUNK):
+            inFlight.acquire()
+            futures.append(executor.submit(contextvars.copy_context().run, write, chunk))
+            count += len(chunk)
+            # surface failures early and forget finished chunks
+            while futures and futures[0].done():
+                futures.pop(0).result()
+        for future in futures:
+            future.result()
+    return count
+
+
+def chunks_of(items, size):
+    # chunks() for any iterable, without materializing it
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_items(model, pages, path, columns, format=None):
+    # writes the pages of a search to path, compressed fields unpacked,
+    # returns the number of items
+    format = _format(path, format)
+    count = 0
+    with closing(pages), _open(path, 'w') as file:
+        if format == 'csv':
+            # the model's fields, other attributes have no column
+            writer = csv.DictWriter(file, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            for items in pages:
+                writer.writerows(
+                    {key: _cell(value) for key, value in unpack_values(model, item).items()} for item in items
+                )
+                count += len(items)
+        else:
+            for items in pages:
+                file.writelines(json.dumps(unpack_values(model, item), default=_json) + '\n' for item in items)
+                count += len(items)
+    return count
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class LRUCache:
+    # Thread safe LRU mapping with a time to live. Entries are kept for `ttl`
+    # seconds at most, the least recently used ones are evicted past `size`.
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class ModelCache:
+    # Per-model read-through cache: full items by id, and the items returned
+    # by a search keyed on its arguments. Any write to the model drops every
+    # cached search since it may change their results.
+    def __init__(self, size=1024, ttl=60):
+        self.records = LRUCache(size, ttl)
+        self.searches = LRUCache(size, ttl)
+
+    def invalidate(self, ids=None):
+        for ID in ids or []:
+            self.records.pop(ID)
+        self.searches.clear()
+
+    def clear(self):
+        self.records.clear()
+        self.searches.clear()
+
+    def stats(self):
+        return {
+            'records': self.records.stats(),
+            'searches': self.searches.stats(),
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(model):
+    # the model's cache, or None when `_cache_size` is 0
+    if not model._cache_size:
+        return None
+    cache = _caches.get(model._name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(model._name, ModelCache(model._cache_size, model._cache_ttl))
+    return cache
+
+
+_identity = ContextVar('identity', default=None)
+
+
+@contextmanager
+def scope():
+    # Within the block every record id maps to a single live instance, e.g.
+    # wrap a Lambda invocation so reads of the same record share one object.
+    token = _identity.set({})
+    try:
+        yield
+    finally:
+        _identity.reset(token)
+
+
+def identity_map():
+    return _identity.get()
@@ -0,0 +1,50 @@
+import time
+from decimal import Decimal
+
+from base import Shard
+
+# Incremental sync. createdAt/updatedAt are numbers (epoch seconds), and
+# models with a `_change_bucket` (in seconds) also store
+#
+#   changeBucket = '<start of the updatedAt bucket>#<shard>'
+#
+# indexed by 'changesIndex' with updatedAt as range key, the `_change_shards`
+# spreading the writes of the current bucket. changed_since() then queries
+# the buckets (and shards) its interval covers in parallel instead of
+# scanning the table.
+
+BUCKET = 'changeBucket'
+INDEX = 'changesIndex'
+# GSIs are eventually consistent, changes more recent than this many seconds
+# are left to the next sync
+LAG = 5
+TIMESTAMPS = ('createdAt', 'updatedAt')
+
+
+def now():
+    # microseconds, as a Decimal DynamoDB takes as a number
+    return Decimal(time.time_ns() // 1000).scaleb(-6)
+
+
+def indexes(model):
+    # the model's extra GSIs, with the changes index when enabled
+    return list(model._indexes or []) + (
+        [{'name': INDEX, 'hash': BUCKET, 'range': 'updatedAt'}] if model._change_bucket else []
+    )
+
+
+def bucket_values(model, values):
+    # sets the bucket of values that set updatedAt, which hold the id
+    if model._change_bucket and values.get('updatedAt') is not None:
+        bucket = int(values['updatedAt'] // model._change_bucket * model._change_bucket)
+        values[BUCKET] = Shard.key(bucket, Shard.shard_of(values['id'], model._change_shards))
+    return values
+
+
+def bucket_keys(model, since, until, limit):
+    # every bucket and shard updates between since and until can be in, None
+    # when there are more than limit of them
+    buckets = range(int(since // model._change_bucket * model._change_bucket), int(until) + 1, model._change_bucket)
+    if len(buckets) * model._change_shards > limit:
+        return None
+    return [Shard.key(bucket, shard) for bucket in buckets for shard in range(model._change_shards)]
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import zlib
+
+from base.Codec import decode, encode
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed fields. Large text or JSON values of a field declared with
+#
+#   {'name': 'payload', 'type': 'M', 'compress': 'zstd', 'threshold': 1024}
+#
+# are stored as a binary (B) attribute holding a codec byte, a kind byte
+# (s for text, j for typed JSON) and the compressed value, when they are at
+# least `threshold` bytes (1 KB by default, smaller values are stored as
+# is). A packed value over the field's `overflow` size (100 KB) goes to the
+# model's `_overflow` store when it has one, and the attribute only holds
+# b'o' and its key. Records keep what they read and only unpack a field on
+# first access. Deleting a record, or writing a new value over an
+# overflowed one, deletes the objects no longer referenced.
+
+THRESHOLD = 1024
+OVERFLOW = 100 * 1024
+LEVEL = {'zlib': 6, 'zstd': 3}
+CODECS = {'zlib': b'z', 'zstd': b'd'}
+REFERENCE = b'o'
+
+
+def packed(fields):
+    # field name -> field, for the compressed fields
+    packed = {}
+    for field in fields or []:
+        if not field.get('compress'):
+            continue
+        if field.get('index'):
+            raise Exception(f'{field.get("name")} is indexed and can not be compressed')
+        if field.get('type') == 'B':
+            # stored bytes are told from packed values by their type alone
+            raise Exception(f'{field.get("name")} is binary and can not be compressed')
+        codec = 'zlib' if field.get('compress') is True else field.get('compress')
+        if codec not in CODECS:
+            raise Exception(f'Unknown compression {codec}, use one of {", ".join(CODECS)}')
+        packed[field.get('name')] = dict(field, compress=codec)
+    return packed
+
+
+def _compress(codec, data):
+    if codec == 'zlib':
+        return zlib.compress(data, LEVEL['zlib'])
+    if zstandard is None:
+        raise Exception('zstd compression needs the zstandard package')
+    return zstandard.ZstdCompressor(level=LEVEL['zstd']).compress(data)
+
+
+def _decompress(codec, data):
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data)
+    if zstandard is None:
+        raise Exception('zstd compression needs the zstandard package')
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def stored_bytes(value):
+    # the bytes of a B attribute, boto3 wraps them in a Binary, None for
+    # values stored as is
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(getattr(value, 'value', None), bytes):
+        return value.value
+    return None
+
+
+def pack(model, field, ID, value):
+    # the stored value of a compressed field, bytes are already packed as
+    # compressed fields are never binary
+    if value is None or stored_bytes(value) is not None:
+        return value
+    if isinstance(value, str):
+        kind, data = b's', value.encode()
+    else:
+        kind, data = b'j', json.dumps(encode(value), separators=(',', ':')).encode()
+    if len(data) < field.get('threshold', THRESHOLD):
+        return value
+    data = CODECS[field['compress']] + kind + _compress(field['compress'], data)
+    if model._overflow is not None and len(data) > field.get('overflow', OVERFLOW):
+        # content addressed, writing the same value again reuses the object
+        key = f'{model._name}/{ID}/{field.get("name")}/{hashlib.sha256(data).hexdigest()}'
+        model._overflow.put(key, data)
+        return REFERENCE + key.encode()
+    return data
+
+
+def unpack(model, value):
+    data = stored_bytes(value)
+    if data is None:
+        return value
+    if data[:1] == REFERENCE:
+        if model._overflow is None:
+            raise Exception(f'{model._name} has no _overflow store to read {data[1:].decode()} from')
+        data = model._overflow.get(data[1:].decode())
+    text = _decompress(data[:1], data[2:]).decode()
+    return text if data[1:2] == b's' else decode(json.loads(text))
+
+
+def pack_values(model, values):
+    # values as stored, a copy with the compressed fields packed if any
+    fields = packed(model._fields)
+    names = [name for name in fields if values.get(name) is not None]
+    if not names:
+        return values
+    return dict(values, **{name: pack(model, fields[name], values.get('id'), values[name]) for name in names})
+
+
+def unpack_values(model, values):
+    # the compressed fields of stored values unpacked, in a copy
+    names = [name for name in packed(model._fields) if stored_bytes(values.get(name)) is not None]
+    if not names:
+        return values
+    return dict(values, **{name: unpack(model, values[name]) for name in names})
+
+
+def overflowing(model):
+    # the compressed fields whose values can be in the overflow store
+    return list(packed(model._fields)) if model._overflow is not None else []
+
+
+def references(model, items):
+    # the overflow keys stored items refer to
+    keys = set()
+    for item in items:
+        for name in overflowing(model):
+            data = stored_bytes(item.get(name))
+            if data is not None and data[:1] == REFERENCE:
+                keys.add(data[1:].decode())
+    return keys
+
+
+def release(model, keys):
+    for key in keys:
+        model._overflow.delete(key)
+
+
+class Packed:
+    # the unpacked value on access, what was read lives in the slot until then
+    def __init__(self, field, slot):
+        self.field = field
+        self.name = field.get('name')
+        self.slot = slot
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        try:
+            value = self.slot.__get__(record)
+        except AttributeError:
+            return self.__get__(record) if record._loaded() else None
+        if stored_bytes(value) is None:
+            return value
+        # unpacked once, values never unpack to bytes
+        value = unpack(record._model, value)
+        self.slot.__set__(record, value)
+        return value
+
+    def __set__(self, record, value):
+        self.slot.__set__(record, value)
+
+
+class OverflowStore:
+    # where packed values over a field's `overflow` size are kept, e.g. an S3
+    # bucket, by key
+    def put(self, key, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalStore(OverflowStore):
+    # a directory of files, for tests and local development
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, readers never see a partial file
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            raise Exception(f'Overflow value {key} not found')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
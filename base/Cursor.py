@@ -0,0 +1,41 @@
+import base64
+import json
+
+from base.Codec import decode, encode
+
+# Opaque paging cursors: the key of the last item returned, what DynamoDB
+# takes as ExclusiveStartKey to resume right after it, as url safe base64 of
+# its typed JSON so numbers and binaries survive the round trip.
+
+
+def dump(key):
+    if not key:
+        return None
+    typed = {}
+    for name, value in key.items():
+        value = encode(value)
+        if 'B' in value:
+            value = {'B': base64.b64encode(value['B']).decode()}
+        typed[name] = value
+    data = json.dumps(typed, separators=(',', ':'), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def load(cursor):
+    if not cursor:
+        return None
+    try:
+        typed = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return {
+            name: base64.b64decode(value['B']) if 'B' in value else decode(value)
+            for name, value in typed.items()
+        }
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise Exception(f'Invalid cursor {cursor}')
+
+
+def key_of(item, names):
+    # the cursor resuming after item, None when it lacks a key attribute
+    if item is None or any(item.get(name) is None for name in names):
+        return None
+    return dump({name: item[name] for name in names})
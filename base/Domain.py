@@ -0,0 +1,453 @@
+import re
+
+from base import Shard
+from base.Relation import value_of
+
+# Odoo-like domains in polish notation, e.g.
+#   ['|', ('email', '=', 'a@b.c'), '!', ('name', 'like', 'Ahmed')]
+# consecutive terms are implicitly and-ed together.
+
+OPERATOR_ARITY = {'!': 1, '&': 2, '|': 2}
+TERM_OPERATORS = [
+    '=', '!=', '<', '<=', '>', '>=',
+    'in', 'not in', 'between',
+    'like', 'not like', 'ilike', 'not ilike', '=like', 'begins_with',
+]
+# DynamoDB caps the number of IN operands
+MAX_IN_VALUES = 100
+
+
+def normalize(domain):
+    # adds the implicit '&' operators so every operator has explicit operands
+    if not domain:
+        return []
+    result = []
+    expected = 1
+    for token in domain:
+        if expected == 0:
+            result[0:0] = ['&']
+            expected = 1
+        if isinstance(token, (list, tuple)):
+            expected -= 1
+        elif token in OPERATOR_ARITY:
+            expected += OPERATOR_ARITY[token] - 1
+        else:
+            raise Exception(f'Invalid domain token {token}')
+        result.append(token)
+    if expected != 0:
+        raise Exception(f'Invalid domain {domain}')
+    return result
+
+
+def parse(domain):
+    # returns a tree of ('&', left, right), ('|', left, right), ('!', node)
+    # and ('term', field, operator, value) nodes, or None for an empty domain
+    tokens = normalize(domain)
+    if not tokens:
+        return None
+    position = 0
+
+    def node():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        if token == '!':
+            return '!', node()
+        if token in ('&', '|'):
+            left = node()
+            return token, left, node()
+        if len(token) != 3:
+            raise Exception(f'Invalid domain term {token}')
+        field, operator, value = token
+        operator = operator.lower()
+        if operator not in TERM_OPERATORS:
+            raise Exception(f'Invalid operator {operator}')
+        if operator == 'between' and (not isinstance(value, (list, tuple)) or len(value) != 2):
+            raise Exception(f'between expects two values, got {value}')
+        if operator in ('in', 'not in'):
+            value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        return 'term', field, operator, value
+
+    return node()
+
+
+def conjuncts(node):
+    # flattens the top level and-ed nodes
+    if node is None:
+        return []
+    if node[0] == '&':
+        return conjuncts(node[1]) + conjuncts(node[2])
+    return [node]
+
+
+def conjunction(nodes):
+    node = None
+    for child in nodes:
+        node = child if node is None else ('&', node, child)
+    return node
+
+
+def fields_of(node):
+    if node is None:
+        return []
+    if node[0] == 'term':
+        return [node[1]]
+    return [field for child in node[1:] for field in fields_of(child)]
+
+
+def _pattern(value):
+    # '=like' patterns: % matches any string, _ any character
+    return re.compile(''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in str(value)
+    ), re.S)
+
+
+def _prefix(value):
+    # '=like' patterns of the form 'abc%' are a DynamoDB begins_with()
+    value = str(value)
+    if value.endswith('%') and '%' not in value[:-1] and '_' not in value:
+        return value[:-1]
+    return None
+
+
+def _compare(operator, current, value):
+    if operator == '=':
+        return current == value
+    if operator == '!=':
+        return current != value
+    if operator == 'in':
+        return current in value
+    if operator == 'not in':
+        return current not in value
+    if operator == 'not like':
+        return current is None or str(value) not in str(current)
+    if operator == 'not ilike':
+        return current is None or str(value).casefold() not in str(current).casefold()
+    if current is None:
+        return False
+    if operator == 'like':
+        return str(value) in str(current)
+    if operator == 'ilike':
+        return str(value).casefold() in str(current).casefold()
+    if operator == '=like':
+        return bool(_pattern(value).fullmatch(str(current)))
+    if operator == 'begins_with':
+        return str(current).startswith(str(value))
+    try:
+        if operator == '<':
+            return current < value
+        if operator == '<=':
+            return current <= value
+        if operator == '>':
+            return current > value
+        if operator == '>=':
+            return current >= value
+        if operator == 'between':
+            return value[0] <= current <= value[1]
+    except TypeError:
+        return False
+    return False
+
+
+def evaluate(node, record):
+    # in-memory evaluation against a record instance or an item dict
+    if node is None:
+        return True
+    if node[0] == '&':
+        return evaluate(node[1], record) and evaluate(node[2], record)
+    if node[0] == '|':
+        return evaluate(node[1], record) or evaluate(node[2], record)
+    if node[0] == '!':
+        return not evaluate(node[1], record)
+    _, field, operator, value = node
+    if isinstance(record, dict):
+        current = record.get(field)
+    else:
+        # many2one fields compare on the id, without fetching the record
+        current = value_of(record, field)
+    return _compare(operator, current, value)
+
+
+def pushable(node):
+    # whether DynamoDB can evaluate the node in a FilterExpression
+    if node[0] in ('&', '|'):
+        return pushable(node[1]) and pushable(node[2])
+    if node[0] == '!':
+        return pushable(node[1])
+    _, field, operator, value = node
+    if operator in ('ilike', 'not ilike'):
+        return False
+    if operator == '=like':
+        return _prefix(value) is not None
+    if operator in ('in', 'not in'):
+        return 0 < len(value) <= MAX_IN_VALUES
+    return True
+
+
+class Expression:
+    # collects the placeholders shared by the key condition and filter
+    def __init__(self):
+        self.names = {}
+        self.values = {}
+
+    def name(self, field):
+        for placeholder, name in self.names.items():
+            if name == field:
+                return placeholder
+        placeholder = f'#d{len(self.names)}'
+        self.names[placeholder] = field
+        return placeholder
+
+    def value(self, value):
+        placeholder = f':d{len(self.values)}'
+        self.values[placeholder] = value
+        return placeholder
+
+    def compile(self, node):
+        if node[0] in ('&', '|'):
+            operator = 'AND' if node[0] == '&' else 'OR'
+            return f'({self.compile(node[1])} {operator} {self.compile(node[2])})'
+        if node[0] == '!':
+            return f'(NOT {self.compile(node[1])})'
+        _, field, operator, value = node
+        name = self.name(field)
+        if operator in ('=', '<', '<=', '>', '>='):
+            return f'{name} {operator} {self.value(value)}'
+        if operator == '!=':
+            # like Odoo, records without the attribute match '!='
+            return f'(attribute_not_exists({name}) OR {name} <> {self.value(value)})'
+        if operator in ('in', 'not in'):
+            values = ', '.join(map(self.value, value))
+            condition = f'{name} IN ({values})'
+            return condition if operator == 'in' else f'(NOT {condition})'
+        if operator == 'between':
+            return f'{name} BETWEEN {self.value(value[0])} AND {self.value(value[1])}'
+        if operator == 'like':
+            return f'contains({name}, {self.value(value)})'
+        if operator == 'not like':
+            return f'(NOT contains({name}, {self.value(value)}))'
+        if operator == '=like':
+            return f'begins_with({name}, {self.value(_prefix(value))})'
+        if operator == 'begins_with':
+            return f'begins_with({name}, {self.value(value)})'
+        raise Exception(f'{operator} can not be sent to DynamoDB')
+
+
+class Plan:
+    # How a domain is executed: 'get' (batch_get_item on ids), 'query' (on
+    # the table or one of its GSIs) or 'scan', with the pushed down filter
+    # and whatever has to be evaluated in memory. `fetch` is set when the
+    # queried index doesn't project every needed attribute, the full items
+    # are then read from the table by id. `key`, `range` and `pushed` are the
+    # terms behind the key condition and filter, for backends that don't
+    # speak DynamoDB expressions. Queries return items in the order of the
+    # range key (`order` when asked for), descending when `forward` is
+    # False. A query on several hash values, those of an 'in' or the shards
+    # of a sharded index, runs once per `shards` entry, its
+    # ExpressionAttributeValues selecting the value.
+    def __init__(self, kind, index=None, keys=None, key_condition=None, filter=None,
+                 names=None, values=None, residual=None, fetch=False, key=None, range=None, pushed=None,
+                 forward=True, shards=None, order=None):
+        self.kind = kind
+        self.forward = forward
+        self.order = order
+        self.shards = shards
+        self.index = index
+        self.keys = keys
+        self.key_condition = key_condition
+        self.filter = filter
+        self.key = key
+        self.range = range
+        self.pushed = pushed
+        self.names = names or {}
+        self.values = values or {}
+        self.residual = residual
+        self.fetch = fetch
+
+    def params(self):
+        params = {}
+        if self.index:
+            params['IndexName'] = self.index
+        if self.key_condition:
+            params['KeyConditionExpression'] = self.key_condition
+        if self.filter:
+            params['FilterExpression'] = self.filter
+        if self.names:
+            params['ExpressionAttributeNames'] = dict(self.names)
+        if self.values:
+            params['ExpressionAttributeValues'] = dict(self.values)
+        if not self.forward:
+            params['ScanIndexForward'] = False
+        return params
+
+
+RANGE_OPERATORS = ['=', '<', '<=', '>', '>=', 'between', 'begins_with', '=like']
+
+
+def _range_term(terms, field):
+    # position and term of the first condition a range key can serve
+    for position, term in enumerate(terms):
+        if term[0] == 'term' and term[1] == field and term[2] in RANGE_OPERATORS:
+            if term[2] != '=like' or _prefix(term[3]) is not None:
+                return position, term
+    return None, None
+
+
+def _range_condition(terms, rangePosition):
+    # The range key condition and the positions of the terms it expresses
+    # exactly. A lower and an upper bound make one BETWEEN, DynamoDB takes a
+    # single condition on the range key and no filter on it, so strict
+    # bounds are left to be checked in memory.
+    term = terms[rangePosition]
+    lower, upper = ('>', '>='), ('<', '<=')
+    if term[2] not in lower + upper:
+        return term, {rangePosition}
+    other = upper if term[2] in lower else lower
+    for position, bound in enumerate(terms):
+        if bound[0] == 'term' and bound[1] == term[1] and bound[2] in other:
+            low, high = (term, bound) if term[2] in lower else (bound, term)
+            try:
+                if low[3] > high[3]:
+                    break
+            except TypeError:
+                break
+            exact = {rangePosition, position} - {
+                termPosition for termPosition in (rangePosition, position) if terms[termPosition][2] in ('>', '<')
+            }
+            return ('term', term[1], 'between', [low[3], high[3]]), exact
+    return term, {rangePosition}
+
+
+def _key_candidates(terms, schema, fields=None, sharded=None):
+    # (score, not covering, position, term, index, range position) for every
+    # term that can drive a request, lower scores are more selective. An
+    # 'in' on an index hash runs a query per value.
+    candidates = []
+    hashKey = schema.key_schema.get('HASH')
+    sharded = sharded or {}
+    for position, term in enumerate(terms):
+        if term[0] != 'term':
+            continue
+        _, field, operator, value = term
+        if field == hashKey and operator in ('=', 'in') and value not in (None, []):
+            candidates.append((0, False, position, term, None, None))
+        elif (operator == '=' and value is not None) or \
+                (operator == 'in' and value and None not in value and len(value) <= MAX_IN_VALUES):
+            indexes = schema.indexes_for(Shard.attribute(field)) if field in sharded else schema.indexes_for(field)
+            for index in indexes:
+                rangeKey = schema.indexes[index]['keys'].get('RANGE')
+                rangePosition, rangeTerm = _range_term(terms, rangeKey) if rangeKey else (None, None)
+                candidates.append((
+                    (1 if rangeTerm else 2) + (2 if operator == 'in' else 0),
+                    not schema.covers(index, fields),
+                    position,
+                    term,
+                    index,
+                    rangePosition,
+                ))
+    return sorted(candidates, key=lambda candidate: candidate[:3])
+
+
+def key_attributes(schema, index=None):
+    # the key attributes of the table and of the queried index
+    keys = set(schema.key_schema.values())
+    if index is not None:
+        keys |= set(schema.indexes[index]['keys'].values())
+    return keys
+
+
+def parse_order(order):
+    # 'field' or 'field desc' -> (field, ascending)
+    if not order:
+        return None, True
+    field, _, direction = order.strip().partition(' ')
+    direction = direction.strip().lower() or 'asc'
+    if direction not in ('asc', 'desc'):
+        raise Exception(f'Invalid order {order}, use "field" or "field desc"')
+    return field, direction == 'asc'
+
+
+def plan(domain, schema, fields=None, order=None, sharded=None):
+    # `fields` are the attributes the caller needs, None for whole items.
+    # Results can only be ordered by the range key of the queried index.
+    # `sharded` maps the fields with sharded indexes to their shard count.
+    node = parse(domain)
+    terms = conjuncts(node)
+    needed = None if fields is None else list(fields) + fields_of(node)
+    candidates = _key_candidates(terms, schema, needed, sharded)
+    orderField, forward = parse_order(order)
+    if orderField:
+        candidates = [
+            candidate for candidate in candidates
+            if candidate[4] and schema.indexes[candidate[4]]['keys'].get('RANGE') == orderField
+        ]
+        if not candidates:
+            raise Exception(f'Can not order by {orderField}, the domain has to query an index ranged on it')
+    expression = Expression()
+
+    if not candidates:
+        pushed = [term for term in terms if pushable(term)]
+        residual = [term for term in terms if not pushable(term)]
+        return Plan(
+            'scan',
+            filter=' AND '.join(map(expression.compile, pushed)) or None,
+            names=expression.names,
+            values=expression.values,
+            residual=conjunction(residual),
+            pushed=conjunction(pushed),
+        )
+
+    _, uncovered, position, key, index, rangePosition = candidates[0]
+    if index is None and key[2] == 'in':
+        # ids are fetched with batch_get_item, which takes no filter
+        return Plan(
+            'get',
+            keys=list(dict.fromkeys(key[3])),
+            residual=conjunction(terms[:position] + terms[position + 1:]),
+        )
+
+    shards = None
+    if index is not None:
+        hashField = key[1]
+        hashValues = list(dict.fromkeys(key[3])) if key[2] == 'in' else [key[3]]
+        if index not in schema.indexes_for(hashField):
+            # a sharded index, queried on every '<value>#<shard>' of its hash
+            hashValues = [shardKey for value in hashValues for shardKey in Shard.keys(value, sharded[hashField])]
+            hashField = Shard.attribute(hashField)
+        key = ('term', hashField, '=', hashValues[0])
+        if len(hashValues) > 1:
+            shards = [{f':d{len(expression.values)}': value} for value in hashValues]
+    key_condition = f'{expression.name(key[1])} = {expression.value(key[3])}'
+    rangeTerm, exact = None, set()
+    if rangePosition is not None:
+        rangeTerm, exact = _range_condition(terms, rangePosition)
+        key_condition += f' AND {expression.compile(rangeTerm)}'
+    rest = [term for termPosition, term in enumerate(terms) if termPosition != position and termPosition not in exact]
+    # DynamoDB rejects filters on the key attributes of what is queried, and
+    # attributes an index doesn't project are missing from its items, so
+    # terms on them can only be checked once the items are fetched
+    keyAttributes = key_attributes(schema, index)
+    pushed = [
+        term for term in rest
+        if pushable(term) and not keyAttributes & set(fields_of(term))
+        and (index is None or schema.covers(index, fields_of(term)))
+    ]
+    residual = [term for term in rest if term not in pushed]
+    # key attributes are always projected
+    fetched = [term for term in residual if not set(fields_of(term)) <= keyAttributes]
+    return Plan(
+        'query',
+        index=index,
+        key_condition=key_condition,
+        filter=' AND '.join(map(expression.compile, pushed)) or None,
+        names=expression.names,
+        values=expression.values,
+        residual=conjunction(residual),
+        fetch=index is not None and (uncovered or bool(fetched)),
+        key=key,
+        range=rangeTerm,
+        pushed=conjunction(pushed),
+        forward=forward,
+        shards=shards,
+        order=orderField,
+    )
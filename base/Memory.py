@@ -0,0 +1,279 @@
+import threading
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+from base.Backend import Backend, dynamodb, projected
+from base.Changes import indexes
+from base.Codec import decode, encode
+from base.Domain import _prefix, evaluate, fields_of, key_attributes, plan
+from base.Registry import Schema, index_definitions
+
+# An in-process storage engine for tests, local development and small
+# read-mostly lookup tables. Every GSI of the model is kept as a hash index
+# (hash value -> ids) or, with a range key, as hash value -> ids sorted on the
+# range value, so the plans the ORM runs against DynamoDB are answered by
+# lookups and bisections instead of scans.
+#
+#   User._backend = MemoryBackend()
+
+PAGE_SIZE = 1000
+_types = {'S': (str,), 'N': (int, float, Decimal), 'B': (bytes, bytearray)}
+
+
+def _stored(item):
+    # the item as DynamoDB would return it, e.g. numbers as Decimal
+    return {key: _value(value) for key, value in item.items()}
+
+
+def _value(value):
+    if value is None or isinstance(value, (str, bool, Decimal)):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    if isinstance(value, (dict, list, tuple, set, frozenset)):
+        return decode(encode(value))
+    return value
+
+
+class RangeIndex:
+    # ids sorted on their range value, ties kept in insertion order
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def add(self, value, ID):
+        position = bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.ids.insert(position, ID)
+
+    def remove(self, value, ID):
+        position = bisect_left(self.values, value) + self.ids[
+            bisect_left(self.values, value):bisect_right(self.values, value)
+        ].index(ID)
+        del self.values[position]
+        del self.ids[position]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def select(self, operator=None, value=None):
+        if operator is None:
+            return list(self.ids)
+        if operator in ('begins_with', '=like'):
+            prefix = value if operator == 'begins_with' else _prefix(value)
+            start = bisect_left(self.values, prefix)
+            end = start
+            while end < len(self.values) and str(self.values[end]).startswith(prefix):
+                end += 1
+            return self.ids[start:end]
+        start, end = 0, len(self.values)
+        if operator == '=':
+            start, end = bisect_left(self.values, value), bisect_right(self.values, value)
+        elif operator == '<':
+            end = bisect_left(self.values, value)
+        elif operator == '<=':
+            end = bisect_right(self.values, value)
+        elif operator == '>':
+            start = bisect_right(self.values, value)
+        elif operator == '>=':
+            start = bisect_left(self.values, value)
+        elif operator == 'between':
+            start, end = bisect_left(self.values, value[0]), bisect_right(self.values, value[1])
+        return self.ids[start:end]
+
+
+class MemoryTable:
+    def __init__(self, schema):
+        self.schema = schema
+        self.items = {}
+        # index name -> hash value -> ids (in insertion order), or a RangeIndex
+        # for indexes with a range key
+        self.indexes = {name: {} for name in schema.indexes}
+        self._lock = threading.RLock()
+
+    def _check(self, item):
+        # key attributes have to match their declared type, like DynamoDB
+        if not isinstance(item.get('id'), str) or not item['id']:
+            raise Exception(f'Invalid id {item.get("id")!r}')
+        for name, kind in self.schema.attributes.items():
+            if item.get(name) is not None and not isinstance(item[name], _types.get(kind, object)):
+                raise Exception(f'{name} must be of type {kind}, got {item[name]!r}')
+
+    def _index(self, item, add=True):
+        for name, index in self.schema.indexes.items():
+            hashValue = item.get(index['keys'].get('HASH'))
+            rangeKey = index['keys'].get('RANGE')
+            if hashValue is None or (rangeKey and item.get(rangeKey) is None):
+                # sparse, like a GSI
+                continue
+            entries = self.indexes[name]
+            if rangeKey:
+                if add:
+                    entries.setdefault(hashValue, RangeIndex()).add(item[rangeKey], item['id'])
+                else:
+                    entries[hashValue].remove(item[rangeKey], item['id'])
+                    if not entries[hashValue]:
+                        del entries[hashValue]
+            elif add:
+                entries.setdefault(hashValue, {})[item['id']] = None
+            else:
+                entries[hashValue].pop(item['id'], None)
+                if not entries[hashValue]:
+                    del entries[hashValue]
+
+    def put(self, item):
+        item = _stored(item)
+        self._check(item)
+        with self._lock:
+            current = self.items.get(item['id'])
+            if current is not None:
+                self._index(current, add=False)
+            self.items[item['id']] = item
+            self._index(item)
+
+    def delete(self, ID):
+        with self._lock:
+            current = self.items.pop(ID, None)
+            if current is not None:
+                self._index(current, add=False)
+
+    def update(self, ID, values):
+        with self._lock:
+            current = self.items.get(ID)
+            if current is None:
+                raise Exception(f'{ID} does not exist')
+            item = dict(current)
+            values = _stored(values)
+            for key, value in values.items():
+                if value is None:
+                    item.pop(key, None)
+                else:
+                    item[key] = value
+            self.put(item)
+            return {key: value for key, value in values.items() if value is not None and key != 'id'}
+
+    def get(self, ids):
+        with self._lock:
+            return [dict(self.items[ID]) for ID in dict.fromkeys(ids) if ID in self.items]
+
+    def candidates(self, searchPlan):
+        # ids selected by the plan's keys, in DynamoDB's order
+        if searchPlan.kind == 'get':
+            return list(dict.fromkeys(searchPlan.keys))
+        if searchPlan.kind == 'scan':
+            return list(self.items)
+        _, field, operator, value = searchPlan.key
+        if searchPlan.index is None:
+            return [value]
+        if searchPlan.shards:
+            ids = [ID for shard in searchPlan.shards for ID in self._candidates(searchPlan, *shard.values())]
+            rangeKey = self.schema.indexes[searchPlan.index]['keys'].get('RANGE')
+            if rangeKey:
+                # merged on the range key, like the sharded queries
+                ids.sort(key=lambda ID: self.items[ID][rangeKey])
+            return ids
+        return self._candidates(searchPlan, value)
+
+    def _candidates(self, searchPlan, value):
+        entries = self.indexes[searchPlan.index].get(value)
+        if entries is None:
+            return []
+        if isinstance(entries, RangeIndex):
+            if searchPlan.range:
+                return entries.select(searchPlan.range[2], searchPlan.range[3])
+            return entries.select()
+        return list(entries)
+
+
+class MemoryBackend(Backend):
+    def __init__(self):
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def table(self, model):
+        table = self.tables.get(model._name)
+        if table is None:
+            with self._lock:
+                if model._name not in self.tables:
+                    self.tables[model._name] = MemoryTable(Schema(model._name, None, _description(model)))
+                table = self.tables[model._name]
+        return table
+
+    def schema(self, model):
+        return self.table(model).schema
+
+    def put(self, model, item):
+        self.table(model).put(item)
+
+    def batch(self, model, puts=(), deletes=()):
+        table = self.table(model)
+        for item in puts:
+            table.put(item)
+        for ID in deletes:
+            table.delete(ID)
+
+    def get(self, model, ids, fields=None):
+        return projected(self.table(model).get(ids), fields)
+
+    def update(self, model, ID, values, returning=False):
+        return self.table(model).update(ID, values)
+
+    def commit(self, changes, atomic=False):
+        if atomic:
+            # all or nothing: every updated record has to exist
+            for model, kind, payload in changes:
+                if kind == 'update' and payload['id'] not in self.table(model).items:
+                    raise Exception(f'{payload["id"]} does not exist')
+        return super().commit(changes)
+
+    def search(self, model, searchPlan, fields=None, limit=None, segments=1, max_workers=8, start=None):
+        table = self.table(model)
+        if searchPlan.kind == 'query' and key_attributes(table.schema, searchPlan.index) & set(
+                fields_of(searchPlan.pushed)):
+            # like DynamoDB
+            raise Exception('Filter Expression can only contain non-primary key attributes')
+        with table._lock:
+            ids = table.candidates(searchPlan)
+            if not searchPlan.forward:
+                ids.reverse()
+            if start and start.get('id') in ids:
+                ids = ids[ids.index(start['id']) + 1:]
+            items = table.get(ids)
+        if searchPlan.pushed:
+            items = [item for item in items if evaluate(searchPlan.pushed, item)]
+        if limit and not searchPlan.residual:
+            items = items[:limit]
+        if fields:
+            items = projected(items, list(fields) + fields_of(searchPlan.residual))
+        for start in range(0, len(items), PAGE_SIZE):
+            yield items[start:start + PAGE_SIZE]
+
+    def load(self, model, items=None):
+        # Fills the model's table, by default with every item of its DynamoDB
+        # table, e.g. to serve a small read-mostly lookup table from memory.
+        if items is None:
+            searchPlan = plan(None, dynamodb.schema(model))
+            items = (item for page in dynamodb.search(model, searchPlan) for item in page)
+        self.batch(model, puts=items)
+
+    def clear(self, model=None):
+        with self._lock:
+            if model is None:
+                self.tables.clear()
+            else:
+                self.tables.pop(model._name, None)
+
+
+def _description(model):
+    # what DescribeTable would return for the model's table
+    AttributeDefinitions, GlobalSecondaryIndexes = index_definitions(model._fields or [], indexes(model))
+    AttributeDefinitions = dict(AttributeDefinitions, id='S')
+    return {
+        'AttributeDefinitions': [
+            {'AttributeName': name, 'AttributeType': kind} for name, kind in AttributeDefinitions.items()
+        ],
+        'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        'GlobalSecondaryIndexes': [dict(index, IndexStatus='ACTIVE') for index in GlobalSecondaryIndexes],
+    }
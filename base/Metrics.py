@@ -0,0 +1,297 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import types
+from collections import Counter
+
+# Instrumentation of the public model methods. Every call made while at least
+# one sink is subscribed produces a Call with its wall time and what its
+# DynamoDB requests cost: requests, items and bytes returned, retries,
+# throttles, unprocessed batch keys and the ConsumedCapacity DynamoDB reports
+# (ReturnConsumedCapacity is requested for the duration of the call). The
+# numbers are collected by botocore event handlers on the package's clients,
+# so requests made from worker threads count towards the call that started
+# them. Sinks are callables taking the finished Call, e.g.
+#
+#   metrics = MemorySink()
+#   subscribe(metrics)
+#   subscribe(LogSink())
+
+# operations that accept ReturnConsumedCapacity
+CAPACITY_OPERATIONS = {
+    'GetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'Query', 'Scan', 'BatchGetItem', 'BatchWriteItem',
+    'TransactGetItems', 'TransactWriteItems', 'ExecuteStatement', 'BatchExecuteStatement', 'ExecuteTransaction',
+}
+THROTTLING_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+
+logger = logging.getLogger('serverlessORM')
+sinks = []
+_current = contextvars.ContextVar('call', default=None)
+
+
+class Call:
+    def __init__(self, model, method):
+        self.model = model
+        self.method = method
+        self.duration = 0.0
+        self.requests = 0
+        self.items = 0
+        self.bytes = 0
+        self.retries = 0
+        self.throttles = 0
+        self.unprocessed = 0
+        self.capacity = 0.0
+        # requests per operation, and per index for queries and scans
+        self.operations = Counter()
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add(self, operation, items=0, size=0, retries=0, capacity=0.0, unprocessed=0):
+        with self._lock:
+            self.requests += 1
+            self.operations[operation] += 1
+            self.items += items
+            self.bytes += size
+            self.retries += retries
+            self.capacity += capacity
+            self.unprocessed += unprocessed
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+
+    def to_dict(self):
+        return {
+            'model': self.model,
+            'method': self.method,
+            'duration_ms': round(self.duration * 1000, 3),
+            'requests': self.requests,
+            'items': self.items,
+            'bytes': self.bytes,
+            'retries': self.retries,
+            'throttles': self.throttles,
+            'unprocessed': self.unprocessed,
+            'capacity': self.capacity,
+            'operations': dict(self.operations),
+            'error': self.error,
+        }
+
+
+def subscribe(sink):
+    sinks.append(sink)
+    return sink
+
+
+def unsubscribe(sink):
+    if sink in sinks:
+        sinks.remove(sink)
+
+
+def _emit(call):
+    for sink in list(sinks):
+        try:
+            sink(call)
+        except Exception:
+            # a broken sink must not fail the ORM call
+            logger.exception('metrics sink %r failed', sink)
+
+
+def measured(model, method, function, *args, **kwargs):
+    # runs function as one instrumented call, nested calls count towards
+    # the outermost one
+    if not sinks or _current.get() is not None:
+        return function(*args, **kwargs)
+    call = Call(model._name, method)
+    try:
+        result = _run(call, function, *args, **kwargs)
+    except Exception:
+        _emit(call)
+        raise
+    if isinstance(result, types.GeneratorType):
+        # a lazy result, the call goes on while it is iterated
+        return _trace(call, result)
+    _emit(call)
+    return result
+
+
+def trace(model, method, generator):
+    # Instruments a lazy result: every step runs within the call, which is
+    # emitted once the generator is exhausted or closed. The duration is the
+    # time spent producing items, not the consumer's.
+    if not sinks or _current.get() is not None:
+        return generator
+    return _trace(Call(model._name, method), generator)
+
+
+def _run(call, function, *args, **kwargs):
+    token = _current.set(call)
+    started = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    except Exception as e:
+        call.error = repr(e)
+        raise
+    finally:
+        call.duration += time.perf_counter() - started
+        _current.reset(token)
+
+
+def _trace(call, generator):
+    context = contextvars.copy_context()
+    context.run(_current.set, call)
+
+    def steps():
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = context.run(next, generator)
+                except StopIteration:
+                    return
+                finally:
+                    call.duration += time.perf_counter() - started
+                yield item
+        except Exception as e:
+            call.error = repr(e)
+            raise
+        finally:
+            generator.close()
+            _emit(call)
+
+    return steps()
+
+
+def instrument(function):
+    # decorator for the public methods of models and records
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        if not sinks:
+            return function(self, *args, **kwargs)
+        model = getattr(self, '_model', None) or self
+        return measured(model, function.__name__, function, self, *args, **kwargs)
+
+    return wrapper
+
+
+def _count(parsed):
+    if 'Items' in parsed:
+        return len(parsed['Items'])
+    if 'Responses' in parsed:
+        responses = parsed['Responses']
+        if isinstance(responses, dict):
+            return sum(map(len, responses.values()))
+        return len(responses)
+    return 1 if parsed.get('Item') or parsed.get('Attributes') else 0
+
+
+def _capacity(parsed):
+    capacity = parsed.get('ConsumedCapacity') or []
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    return sum(float(entry.get('CapacityUnits', 0)) for entry in capacity)
+
+
+def _unprocessed(parsed):
+    unprocessed = 0
+    for request in (parsed.get('UnprocessedKeys') or {}).values():
+        unprocessed += len(request.get('Keys', []))
+    for requests in (parsed.get('UnprocessedItems') or {}).values():
+        unprocessed += len(requests)
+    return unprocessed
+
+
+def _provide_params(params, model, context, **kwargs):
+    if _current.get() is None:
+        return
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    if params.get('IndexName'):
+        context['serverlessORM_index'] = params['IndexName']
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    call = _current.get()
+    if call is None:
+        return
+    operation = model.name
+    if context.get('serverlessORM_index'):
+        operation += f':{context["serverlessORM_index"]}'
+    call.add(
+        operation,
+        items=_count(parsed),
+        size=len(http_response.content or b''),
+        retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+        capacity=_capacity(parsed),
+        unprocessed=_unprocessed(parsed),
+    )
+
+
+def _needs_retry(response=None, **kwargs):
+    call = _current.get()
+    if call is None or not response:
+        return None
+    if response[1].get('Error', {}).get('Code') in THROTTLING_ERRORS:
+        call.throttled()
+    return None
+
+
+def attach(client):
+    # called by dynamo for every client it builds, the handlers do nothing
+    # outside of an instrumented call
+    client.meta.events.register('provide-client-params.dynamodb', _provide_params)
+    client.meta.events.register('after-call.dynamodb', _after_call)
+    client.meta.events.register('needs-retry.dynamodb', _needs_retry)
+    return client
+
+
+class MemorySink:
+    # aggregates calls per model and method
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, call):
+        with self._lock:
+            stats = self._stats.get((call.model, call.method))
+            if stats is None:
+                stats = self._stats[(call.model, call.method)] = {
+                    'calls': 0, 'errors': 0, 'duration_ms': 0.0, 'max_ms': 0.0, 'requests': 0, 'items': 0,
+                    'bytes': 0, 'retries': 0, 'throttles': 0, 'unprocessed': 0, 'capacity': 0.0,
+                    'operations': Counter(),
+                }
+            stats['calls'] += 1
+            stats['errors'] += call.error is not None
+            stats['duration_ms'] += call.duration * 1000
+            stats['max_ms'] = max(stats['max_ms'], call.duration * 1000)
+            for key in ('requests', 'items', 'bytes', 'retries', 'throttles', 'unprocessed', 'capacity'):
+                stats[key] += getattr(call, key)
+            stats['operations'].update(call.operations)
+
+    def stats(self):
+        # {'<model>.<method>': {...}}, most expensive (consumed capacity) first
+        with self._lock:
+            stats = {
+                f'{model}.{method}': dict(
+                    values, operations=dict(values['operations']), mean_ms=values['duration_ms'] / values['calls']
+                )
+                for (model, method), values in self._stats.items()
+            }
+        return dict(sorted(stats.items(), key=lambda item: (-item[1]['capacity'], -item[1]['duration_ms'])))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LogSink:
+    # one JSON log line per call
+    def __init__(self, log=None, level=logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def __call__(self, call):
+        if self.log.isEnabledFor(self.level):
+            self.log.log(self.level, json.dumps(call.to_dict()))
@@ -1,100 +1,92 @@
-import time
 import uuid
-
-from dynamo import resource
+from contextlib import closing
+from decimal import Decimal
+
+import dynamo
+from base import Async
+from base.Aggregate import Groups, parse_fields
+from base.Backend import dynamodb, projected
+from base.Batch import parallel
+from base.Bulk import EXPORT_SEGMENTS, export_items, import_items, read_items
+from base.Cache import cache_for, identity_map
+from base.Changes import BUCKET, LAG, bucket_keys, bucket_values, now
+from base.Codec import Client, Codec
+from base.Compress import overflowing, pack_values, packed, references, release, unpack_values
+from base.Cursor import key_of, load
+from base.Domain import MAX_IN_VALUES, evaluate, fields_of, parse, plan
+from base.Metrics import instrument, measured, trace
+from base.Record import record_class
+from base.Relation import Prefetch, group, models, stored_values
+from base.Shard import shard_values, sharded
+from base.Transaction import current, transaction
 
 defaultFields = ['id', 'createdAt', 'updatedAt']
 
 
-def bootstrap(name, fields, billing_mode='PAY_PER_REQUEST'):
-    try:
-        table = resource.Table(name)
-        tableFields = list(map(lambda field: field.get('AttributeName'), table.attribute_definitions))
-        missingFields = list(filter(lambda field: field.get('name') not in tableFields and field.get('index'), fields))
-        if missingFields:
-            AttributeDefinitions = []
-            GlobalSecondaryIndexUpdates = []
-            for field in missingFields:
-                AttributeDefinitions.append({
-                    'AttributeName': field.get('name'),
-                    'AttributeType': field.get('type')
-                })
-                GlobalSecondaryIndexUpdates.append({
-                    'Create': {
-                        'IndexName': f'{field.get("name")}Index',
-                        'KeySchema': [
-                            {
-                                'AttributeName': field.get('name'),
-                                'KeyType': 'HASH'
-                            }
-                            # Add more key schema attributes if needed
-                        ],
-                        'Projection': {
-                            'ProjectionType': 'ALL'  # Projection type (e.g., ALL, KEYS_ONLY, INCLUDE)
-                        },
-                    }
-                })
-            table.update(
-                AttributeDefinitions=AttributeDefinitions,
-                GlobalSecondaryIndexUpdates=GlobalSecondaryIndexUpdates,
-            )
-        return table
-    except Exception as e:
-        try:
-            AttributeDefinitions = [
-                {
-                    'AttributeName': 'id',
-                    'AttributeType': 'S'
-                }
-            ]
-            indexFields = list(filter(lambda field: field.get('index'), fields))
-            for field in indexFields:
-                AttributeDefinitions.append({
-                    'AttributeName': field.get('name'),
-                    'AttributeType': field.get('type')
-                })
-            GlobalSecondaryIndexes = list(map(lambda field: {
-                'IndexName': f'{field.get("name")}Index',
-                'KeySchema': [
-                    {
-                        'AttributeName': field.get('name'),
-                        'KeyType': 'HASH'
-                    },
-                ],
-                'Projection': {
-                    'ProjectionType': 'ALL',
-                },
-            }, indexFields))
-            table = resource.create_table(
-                TableName=name,
-                KeySchema=[
-                    {
-                        'AttributeName': 'id',
-                        'KeyType': 'HASH'
-                    }
-                ],
-                BillingMode=billing_mode,
-                AttributeDefinitions=AttributeDefinitions,
-                GlobalSecondaryIndexes=GlobalSecondaryIndexes,
-            )
-            table.wait_until_exists()
-            return table
-        except Exception as e:
-            raise Exception(e)
+class Page(list):
+    # results with the cursor of the next page, None after the last one
+    cursor = None
 
 
 class RecordSet:
     def __init__(self, model, records):
         self.model = model
         self.records = records
+        self.cursor = None
+        # the next changed_since() timestamp of a set it returned
+        self.watermark = None
+
+    @property
+    def records(self):
+        self._fetch()
+        return self._records
+
+    @records.setter
+    def records(self, records):
+        # lists are stored as is, any other iterable (e.g. a paginated search)
+        # is materialized lazily as the set is iterated
+        if isinstance(records, list):
+            self._records = records
+            self._source = None
+        else:
+            self._records = []
+            self._source = iter(records)
+        # the records of a set prefetch their relations together
+        self._prefetch = Prefetch(self._records)
+        for record in self._records:
+            record._prefetch = self._prefetch
+
+    def _fetch(self, index=None):
+        while self._source is not None and (index is None or len(self._records) <= index):
+            try:
+                record = next(self._source)
+                # records of a lazy search keep prefetching with their page
+                if record._prefetch is None:
+                    record._prefetch = self._prefetch
+                self._records.append(record)
+            except StopIteration:
+                self._source = None
 
     def __iter__(self):
-        return iter(self.records)
+        index = 0
+        while True:
+            self._fetch(index)
+            if index >= len(self._records):
+                return
+            yield self._records[index]
+            index += 1
 
     def __len__(self):
         return len(self.records)
 
+    def __bool__(self):
+        self._fetch(0)
+        return bool(self._records)
+
     def __getitem__(self, index):
+        if isinstance(index, int) and index >= 0:
+            self._fetch(index)
+            return self._records[index]
         return self.records[index]
 
     def __str__(self):
@@ -104,26 +96,18 @@ class RecordSet:
         return f"<RecordSet {self.model}({ids})>"
 
     def search(self, domain=None):
-        # Your search logic here
-        # Return a new RecordSet instance with the filtered records
+        # filters the records already in the set, in memory
         filtered_records = self._apply_domain(domain)
         return RecordSet(self.model, filtered_records)
 
     def _apply_domain(self, domain):
-        # Apply the domain filter to the records
-        # and return the filtered records
-        if domain is None:
+        if not domain:
             return self.records
-
-        # Your domain filtering implementation
-        filtered_records = [record for record in self.records if self._check_domain(record, domain)]
-        return filtered_records
+        node = parse(domain)
+        return [record for record in self.records if evaluate(node, record)]
 
     def _check_domain(self, record, domain):
-        # Your domain filtering logic
-        # Implement the domain comparison for each field
-        # in the record and return True or False
-        pass
+        return evaluate(parse(domain), record)
 
     def create(self, values):
         # Create a new record with the given values
@@ -154,10 +138,45 @@ class RecordSet:
 
 class Model:
     _name = None
-    _table = None
     _fields = None
+    # extra GSIs, e.g. {'name': 'statusDateIndex', 'hash': 'status', 'range':
+    # 'createdAt', 'projection': 'INCLUDE', 'include': ['total']}
+    _indexes = None
     _billing_mode = 'PAY_PER_REQUEST'
+    # read/write units of the table and its GSIs with 'PROVISIONED', requests
+    # are rate limited to them (see base.Throttle)
+    _capacity = {'read': 5, 'write': 5}
     _limit = 1
+    # thread pool size and UnprocessedKeys retries for batch requests
+    _max_workers = 8
+    _batch_retries = 8
+    # default number of parallel Scan segments for searches without a domain
+    _scan_segments = 1
+    # read-through cache of records and search results, off when 0
+    _cache_size = 0
+    _cache_ttl = 60
+    # calls of the model the async API runs concurrently
+    _async_concurrency = 16
+    # (de)serialize items with a per-model codec over the low level client
+    _wire_codec = False
+    # resolve (and create/update if needed) the table on first use; set to
+    # False when tables are managed through migrate() at deploy time
+    _auto_migrate = True
+    # where the records live, DynamoDB when None (see base.Backend)
+    _backend = None
+    # seconds per updatedAt bucket of the changes index used by
+    # changed_since(), off when 0, and the shards of each bucket
+    _change_bucket = 0
+    _change_shards = 1
+    # where compressed values over their field's `overflow` size go, a
+    # base.Compress.OverflowStore, kept in the item when None
+    _overflow = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # comodels of relational fields are looked up by _name
+        if cls._name:
+            models[cls._name] = cls
 
     def __init__(self, **kwargs):
         self.id = None
@@ -167,8 +186,43 @@ class Model:
     # def __setitem__(self, key, value):
     #     self[key] = value
 
+    @classmethod
+    def _store(cls):
+        return cls._backend or dynamodb
+
+    @classmethod
+    def _schema(cls):
+        return cls._store().schema(cls)
+
+    @classmethod
+    def migrate(cls):
+        return cls._store().migrate(cls)
+
+    @classmethod
+    def cache_stats(cls):
+        cache = cache_for(cls)
+        return cache.stats() if cache else None
+
+    @classmethod
+    def _invalidate(cls, ids=None):
+        cache = cache_for(cls)
+        if cache:
+            cache.invalidate(ids)
+
+    @staticmethod
+    def transaction(atomic=False):
+        # `with users.transaction():` queues the changes of every model until
+        # the block exits, see base.Transaction
+        return transaction(atomic)
+
+    @classmethod
+    def clear_cache(cls):
+        cache = cache_for(cls)
+        if cache:
+            cache.clear()
+
+    @instrument
     def create(self, values):
-        print(values)
         existingFields = list(map(lambda field: field.get('name'), self._fields))
         if isinstance(values, list):
             for value in values:
@@ -189,151 +243,153 @@ class Model:
         records = []
         if isinstance(values, list):
             try:
-                cls._table = bootstrap(
-                    cls._name,
-                    cls._fields,
-                    cls._billing_mode
-                ) if cls._name else None
-                with cls._table.batch_writer() as batch:
-                    for value in values:
-                        existingFields = list(map(lambda field: field.get('name'), cls._fields))
-                        for key, val in value.items():
-                            if key not in existingFields:
-                                raise Exception(f'Invalid field {key}')
-                        value['createdAt'] = str(time.time())
-                        value['updatedAt'] = str(time.time())
-                        batch.put_item(Item=value)
-                        records.append(cls(**value))
+                existingFields = list(map(lambda field: field.get('name'), cls._fields))
+                for value in values:
+                    for key, val in value.items():
+                        if key not in existingFields and key not in defaultFields:
+                            raise Exception(f'Invalid field {key}')
+                    shard_values(cls, stored_values(cls, value))
+                    value['createdAt'] = value['updatedAt'] = now()
+                    bucket_values(cls, value)
+                # records are built from the values as given
+                stored = [pack_values(cls, value) for value in values]
+                unit = current()
+                if unit:
+                    for value in stored:
+                        unit.put(cls, value)
+                else:
+                    cls._store().batch(cls, puts=stored)
+                records = cls._hydrate_many(values)
             except Exception as e:
                 raise Exception(e)
         if isinstance(values, dict):
             try:
-                cls._table = bootstrap(
-                    cls._name,
-                    cls._fields,
-                    cls._billing_mode
-                ) if cls._name else None
-
-                values['createdAt'] = str(time.time())
-                values['updatedAt'] = str(time.time())
-                response = cls._table.put_item(Item=values)
-                records.append(cls(**values))
+                shard_values(cls, stored_values(cls, values))
+                values['createdAt'] = values['updatedAt'] = now()
+                bucket_values(cls, values)
+                if current():
+                    current().put(cls, pack_values(cls, values))
+                else:
+                    cls._store().put(cls, pack_values(cls, values))
+                records.append(cls._hydrate(values))
             except Exception as e:
                 raise Exception(e)
+        cache = cache_for(cls)
+        if cache and not current():
+            cache.invalidate()
+            for value in values if isinstance(values, list) else [values]:
+                cache.records.put(value['id'], dict(value))
         return records
 
+    @instrument
     def read(self, IDs=None, fields=None):
-        IDs = IDs if IDs else self.id
+        IDs = IDs if IDs else [self.id] if self.id else None
         if not IDs:
             raise Exception('Missing IDs')
         return self._read(IDs, fields)
 
     @classmethod
     def _read(cls, IDS, fields=None):
-        Keys = list(map(lambda ID: {'id': ID}, IDS))
+        # with `fields` only those attributes (and the id) are read, the
+        # others are fetched on first access
         try:
-            cls._table = bootstrap(
-                cls._name,
-                cls._fields,
-                cls._billing_mode
-            ) if cls._name else None
-            AttributeDefinitionsList = list(
-                filter(
-                    lambda filteredAttribute: 'password' not in filteredAttribute and 'secret' not in filteredAttribute,
-                    map(
-                        lambda attribute: attribute.get('AttributeName'),
-                        cls._table.meta.data.get('AttributeDefinitions')
-                    )
-                )
-            )
-            ProjectionExpression = ''
-            AttributeDefinitions = {}
-
-            if fields:
-                for key, attibute in enumerate(fields):
-                    AttributeDefinitions[f'#{attibute}'] = attibute
-                    ProjectionExpression += f'#{attibute}, ' if key < len(
-                        AttributeDefinitionsList) - 1 else f'#{attibute}'
-
-            response = resource.batch_get_item(
-                RequestItems={
-                    cls._name: {
-                        'Keys': Keys,
-                    }
-                }
-            )
-            items = response['Responses'][cls._name]
-            results = []
-            for item in items:
-                instance = cls()
-                for key, value in item.items():
-                    setattr(instance, key, value)
-                results.append(instance)
-            return results
-        #            return items
+            # batch_get_item returns items in no particular order
+            records = {record.id: record for record in cls._hydrate_many(cls._items(IDS, fields), bool(fields))}
+            return [records[ID] for ID in IDS if ID in records]
         except Exception as e:
-            raise Exception(e, 'line 268')
+            raise Exception(f'Reading {len(IDS)} {cls._name} records failed: {e}') from e
 
-    def write(self, values):
+    @classmethod
+    def _items(cls, IDS, fields=None):
+        # the items of IDS from the cache or the table, projected on fields
+        # either way
+        Keys = list(map(lambda ID: {'id': ID}, IDS))
+        cache = cache_for(cls)
+        items = []
+        if cache:
+            for ID in IDS:
+                item = cache.records.get(ID)
+                if item is not None:
+                    items.append(item)
+            cached = set(map(lambda item: item.get('id'), items))
+            Keys = list(filter(lambda key: key['id'] not in cached, Keys))
+            items = projected(items, fields)
+        if Keys:
+            fetched = cls._store().get(cls, [key['id'] for key in Keys], fields)
+            if cache and not fields:
+                for item in fetched:
+                    cache.records.put(item.get('id'), item)
+            items += fetched
+        return items
+
+    @instrument
+    def write(self, values, returning=False):
+        # returning=True returns the updated attributes instead of True
         if isinstance(values, list):
-            if any([not id for id in list(map(lambda item: item.id, values))]):
+            if any([not id for id in list(map(lambda item: item.get('id'), values))]):
                 raise Exception('One record or more missing id')
-            self._write(values)
+            return self._write(values, returning)
         elif isinstance(values, dict):
             if 'id' not in values and not self.id:
                 raise Exception('Missing id or not single record')
-            for key, value in values.items():
-                setattr(self, key, value)
-            return self._write(self.__dict__)
+            values = dict(values)
+            values.setdefault('id', self.id)
+            result = self._write(values, True)
+            if values['id'] == self.id:
+                for key, value in result.items():
+                    setattr(self, key, value)
+            return result if returning else True
         else:
             return False
 
     @classmethod
-    def _write(cls, values):
+    def _write(cls, values, returning=False):
+        # Only the given keys are sent, as a single UpdateItem per record, so
+        # nothing is read first and concurrent writers don't clobber each
+        # other's fields. None values remove the attribute.
         try:
-            cls._table = bootstrap(
-                cls._name,
-                cls._fields,
-                cls._billing_mode
-            ) if cls._name else None
-            with cls._table.batch_writer() as batch:
-                if isinstance(values, list):
-                    recs = cls._read(list(map(lambda rec: rec.id, values)))
-                    for rec in recs:
-                        for item in values:
-                            if rec.id == item.get('id'):
-                                for key, value in item.items():
-                                    if key not in defaultFields \
-                                            and key not in list(map(
-                                        lambda field: field.get('name'), cls._fields)
-                                    ):
-                                        raise Exception(f'{key} does not exist')
-                                    setattr(rec, key, value)
-                                    setattr(rec, 'updatedAt', str(time.time()))
-
-                                #                                    rec[key] = value
-                                #                                    rec['updatedAt'] = str(time.time())
-                                batch.put_item(Item=rec.__dict__)
-                elif isinstance(values, dict):
-                    recs = cls._read(IDS=[values.get('id')])
-                    for key, value in values.items():
-                        if key not in defaultFields \
-                                and key not in list(map(
-                            lambda field: field.get('name'), cls._fields)
-                        ):
-                            raise Exception(f'{key} does not exist')
-                        setattr(recs[0], key, value)
-                        setattr(recs[0], 'updatedAt', str(time.time()))
-
-                    #                        recs[0][key] = value
-                    #                        recs[0]['updatedAt'] = str(time.time())
-                    batch.put_item(Item=recs[0].__dict__)
+            cache = cache_for(cls)
+            if cache:
+                cache.invalidate(map(lambda value: value.get('id'), values if isinstance(values, list) else [values]))
+            if isinstance(values, dict):
+                result = cls._update(values, returning)
+                return result if returning else True
+            if isinstance(values, list):
+                if current():
+                    # only queued, no need for threads
+                    results = [cls._update(value, returning) for value in values]
                 else:
-                    return False
-            return True
+                    results = parallel(lambda value: cls._update(value, returning), values, cls._max_workers)
+                return results if returning else True
+            return False
         except Exception as e:
             raise Exception(e)
 
+    @classmethod
+    def _update(cls, values, returning=False):
+        existingFields = list(map(lambda field: field.get('name'), cls._fields))
+        values = dict(values, updatedAt=now())
+        for key in values:
+            if key != 'id' and key not in defaultFields and key not in existingFields:
+                raise Exception(f'{key} does not exist')
+        bucket_values(cls, shard_values(cls, stored_values(cls, values)))
+        # overflowed values being replaced are only known by reading them
+        replaced = [name for name in overflowing(cls) if name in values]
+        dropped = references(cls, cls._store().get(cls, [values.get('id')], replaced)) if replaced else set()
+        stored = pack_values(cls, values)
+        if current():
+            current().update(cls, stored)
+            # what UPDATED_NEW will return once the transaction is committed
+            attributes = {key: value for key, value in values.items() if value is not None and key != 'id'}
+        else:
+            attributes = cls._store().update(cls, values.get('id'), stored, returning)
+        # writing the same value again keeps its object
+        cls._release(dropped - references(cls, [stored]))
+        if returning:
+            return dict(unpack_values(cls, attributes), id=values.get('id'))
+        return True
+
+    @instrument
     def delete(self, ids=None):
         ids = ids if ids else []
         if not ids:
@@ -347,14 +403,17 @@ class Model:
         try:
             if not ids:
                 return False
-            cls._table = bootstrap(
-                cls._name,
-                cls._fields,
-                cls._billing_mode
-            ) if cls._name else None
-            with cls._table.batch_writer() as batch:
+            cache = cache_for(cls)
+            if cache:
+                cache.invalidate(ids)
+            fields = overflowing(cls)
+            dropped = references(cls, cls._store().get(cls, ids, fields)) if fields else set()
+            if current():
                 for ID in ids:
-                    batch.delete_item(Key={'id': ID})
+                    current().delete(cls, ID)
+            else:
+                cls._store().batch(cls, deletes=ids)
+            cls._release(dropped)
             return True
         except Exception as e:
             raise Exception(e)
@@ -362,167 +421,344 @@ class Model:
     def to_record(self):
         return self
 
-    def search(self, gsi_domain=None, fields=None, limit=None):
-        recs = self._search(gsi_domain, fields, limit)
+    @classmethod
+    def _release(cls, keys):
+        # deletes overflow objects once the change dropping them is written
+        if not keys:
+            return
+        if current():
+            current().on_commit(lambda: release(cls, keys))
+        else:
+            release(cls, keys)
+
+    @classmethod
+    def _client(cls):
+        # Clients are thread safe, unlike the resource's Table objects. With
+        # _wire_codec the low level client is used through the model's Codec
+        # instead of boto3's TypeSerializer/TypeDeserializer.
+        if not cls._wire_codec:
+            return dynamo.resource.meta.client
+        if '_codec' not in cls.__dict__:
+            cls._codec = Codec(cls._fields, defaultFields)
+        return Client(dynamo.client, cls.__dict__['_codec'])
+
+    @classmethod
+    def _record(cls):
+        # the slotted record class generated for this model
+        if '_record_class' not in cls.__dict__:
+            cls._record_class = record_class(cls, defaultFields)
+        return cls.__dict__['_record_class']
+
+    @classmethod
+    def _hydrate(cls, item):
+        return cls._hydrate_many([item])[0]
+
+    @classmethod
+    def _hydrate_many(cls, items, partial=False):
+        # Records loaded together prefetch their relations together. Records
+        # of `partial` (projected) items fetch their missing fields together
+        # on first access.
+        identity = identity_map()
+        if identity is None:
+            records = cls._record().from_items(items)
+            if partial:
+                for record in records:
+                    record._partial = True
+            return group(records)
+        # one live instance per record within a scope()
+        records = []
+        for item in items:
+            instance = identity.get((cls._name, item.get('id')))
+            if instance is None:
+                instance = identity.setdefault((cls._name, item.get('id')), cls._record().from_item(item))
+                instance._partial = partial
+            else:
+                instance._set_values(item)
+            records.append(instance)
+        return group(records)
+
+    def search(self, gsi_domain=None, fields=None, limit=None, lazy=False, segments=None, max_workers=None,
+               order=None, cursor=None):
+        # `order` is 'field' or 'field desc' on the range key of the queried
+        # index. The set's `cursor` resumes the search after its last record.
+        if lazy:
+            # pages are only fetched when iteration reaches them
+            return RecordSet(self._name, trace(
+                self, 'search', self._iter_search(gsi_domain, fields, limit, segments, max_workers, order, cursor)
+            ))
+        recs = measured(self, 'search', self._search, gsi_domain, fields, limit, segments, max_workers, order, cursor)
         record_set = RecordSet(self._name, recs)
+        record_set.cursor = recs.cursor
         return record_set
 
+    @instrument
+    def search_pages(self, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None,
+                     order=None, cursor=None):
+        # every page carries the cursor resuming after it
+        keys = self._cursor_keys(gsi_domain, fields, segments, order, cursor)
+        for items in self._search_pages(gsi_domain, fields, limit, segments, max_workers, order, cursor):
+            page = Page(self._hydrate_many(items, bool(fields)))
+            page.cursor = key_of(items[-1], keys) if keys else None
+            yield page
+
+    @classmethod
+    def _search(cls, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None, order=None,
+                cursor=None):
+        limit = cls._limit if not limit else limit
+        cache = cache_for(cls)
+        key = repr((gsi_domain, fields, limit, order, cursor))
+        items = cache.searches.get(key) if cache else None
+        if items is None:
+            items = [
+                item for page in cls._search_pages(gsi_domain, fields, limit, segments, max_workers, order, cursor)
+                for item in page
+            ]
+            if cache:
+                cache.searches.put(key, items)
+                if not fields:
+                    for item in items:
+                        cache.records.put(item.get('id'), item)
+        records = Page(cls._hydrate_many(items, bool(fields)))
+        # a full page may have a next one
+        keys = cls._cursor_keys(gsi_domain, fields, segments, order, cursor)
+        if keys and items and len(items) == limit:
+            records.cursor = key_of(items[-1], keys)
+        return records
+
+    @classmethod
+    def _iter_search(cls, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None, order=None,
+                     cursor=None):
+        for page in cls._search_pages(gsi_domain, fields, limit, segments, max_workers, order, cursor):
+            for record in cls._hydrate_many(page, bool(fields)):
+                yield record
+
     @classmethod
-    def _search(cls, gsi_domain=None, fields=None, limit=None):
+    def _search_pages(cls, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None, order=None,
+                      cursor=None):
+        # yields the raw items of one response at a time until the results or
+        # `limit` are exhausted
         try:
-            cls._table = bootstrap(
-                cls._name,
-                cls._fields,
-                cls._billing_mode
-            ) if cls._name else None
-            TableName = cls._name
-            ProjectionExpression = ''
-            ExpressionAttributeNames = {}
-            ExpressionAttributeValues = {}
-
-            AttributeDefinitionsList = list(
-                filter(
-                    lambda
-                        filteredAttribute: 'password' not in filteredAttribute and 'secret' not in filteredAttribute,
-                    map(
-                        lambda attribute: attribute.get('AttributeName'),
-                        cls._table.meta.data.get('AttributeDefinitions')
-                    )
-                )
+            searchPlan = cls._search_plan(gsi_domain, fields, order)
+            residual = searchPlan.residual
+            start = load(cursor)
+            if start and searchPlan.shards:
+                raise Exception('Searches querying several hash values can not be resumed from a cursor')
+            if fields and searchPlan.index:
+                # the index keys make the cursor of the last item
+                indexKeys = cls._schema().indexes[searchPlan.index]['keys'].values()
+                fields = list(dict.fromkeys(list(fields) + list(indexKeys)))
+            pages = cls._store().search(
+                cls, searchPlan, fields, limit,
+                # a resumed scan runs in one segment, from the cursor
+                1 if start else segments or cls._scan_segments,
+                max_workers or cls._max_workers, start,
             )
-
-            if fields:
-                if 'id' not in fields:
-                    fields.append('id')
-                for key, field in enumerate(fields):
-                    if field in AttributeDefinitionsList:
-                        ExpressionAttributeNames[f'#{field}'] = field
-                        ProjectionExpression += f'#{field}, ' if key < len(
-                            fields) - 1 else f'#{field}'
-
-            if not gsi_domain:
-                scan_params = {
-                    'TableName': TableName,
-                    'Limit': cls._limit if not limit else limit,
-                    'ProjectionExpression': ProjectionExpression,
-                    'ExpressionAttributeNames': ExpressionAttributeNames
-                }
-                response = cls._table.scan(**scan_params)
-                items = response.get('Items', [])
-                results = []
-                for item in items:
-                    instance = cls()
-                    for key, value in item.items():
-                        setattr(instance, key, value)
-                    results.append(instance)
-                return results
-            for domain in gsi_domain:
-                if domain[0] not in AttributeDefinitionsList:
-                    raise Exception(f'{domain[0]} is not an index field')
-                ExpressionAttributeNames[f'#{domain[0]}'] = f'{domain[0]}'
-                ExpressionAttributeValues[f':{domain[0]}'] = domain[2]
-
-            IndexName = f'{gsi_domain[0][0]}Index'
-            KeyConditionExpression = f'#{gsi_domain[0][0]} {gsi_domain[0][1]} :{gsi_domain[0][0]}'
-
-            query_params = {
-                'TableName': TableName,
-                'IndexName': IndexName,
-                'KeyConditionExpression': KeyConditionExpression,
-                'ExpressionAttributeNames': ExpressionAttributeNames,
-                'ExpressionAttributeValues': ExpressionAttributeValues,
-                'Limit': cls._limit if not limit else limit,
-            }
-            response = cls._table.query(**query_params)
-            items = response.get('Items', [])
-            results = []
-            for item in items:
-                instance = cls()
-                for key, value in item.items():
-                    setattr(instance, key, value)
-                results.append(instance)
-            return results
+            remaining = limit
+            with closing(pages):
+                for items in pages:
+                    if searchPlan.fetch and items:
+                        # the index doesn't project everything we need
+                        fetched = cls._store().get(
+                            cls, [item.get('id') for item in items],
+                            fields and list(fields) + fields_of(residual),
+                        )
+                        fetched = {item.get('id'): item for item in fetched}
+                        items = [fetched[item.get('id')] for item in items if item.get('id') in fetched]
+                    if residual:
+                        items = [item for item in items if evaluate(residual, item)]
+                    if remaining:
+                        items = items[:remaining]
+                        remaining -= len(items)
+                    if items:
+                        yield items
+                    if limit and not remaining:
+                        return
         except Exception as e:
             raise Exception(e)
 
-    def search_read(self, gsi_domain=None, fields=None, limit=_limit):
-        return self._search_read(gsi_domain, fields, limit)
+    @classmethod
+    def _search_plan(cls, gsi_domain=None, fields=None, order=None):
+        # how the backend runs the domain, and the part of it that has to be
+        # evaluated in memory
+        existingFields = list(map(lambda field: field.get('name'), cls._fields)) + defaultFields
+        if cls._change_bucket:
+            existingFields.append(BUCKET)
+        compressed = packed(cls._fields)
+        for field in fields_of(parse(gsi_domain)):
+            if field not in existingFields:
+                raise Exception(f'{field} is not a valid field')
+            if field in compressed:
+                raise Exception(f'{field} is compressed and can not be searched')
+        return plan(gsi_domain, cls._schema(), fields, order, sharded(cls._fields))
+
+    @classmethod
+    def _cursor_keys(cls, gsi_domain=None, fields=None, segments=None, order=None, cursor=None):
+        # the attributes a cursor is made of, the table's and the queried
+        # index's keys, None when a segmented scan leaves no single order
+        searchPlan = cls._search_plan(gsi_domain, fields, order)
+        if searchPlan.kind == 'scan' and not cursor and (segments or cls._scan_segments) > 1:
+            return None
+        if searchPlan.shards:
+            # each of the queried hash values would need its own
+            return None
+        keys = ['id']
+        if searchPlan.index:
+            keys += [key for key in cls._schema().indexes[searchPlan.index]['keys'].values() if key != 'id']
+        return keys
+
+    @instrument
+    def search_read(self, gsi_domain=None, fields=None, limit=_limit, lazy=False, segments=None, max_workers=None,
+                    order=None, cursor=None):
+        # a list of dicts of the `fields` and the id, with the `cursor` of the
+        # next page
+        if lazy:
+            return (
+                projected([record.to_dict()], fields)[0]
+                for record in self._iter_search(gsi_domain, fields, limit, segments, max_workers, order, cursor)
+            )
+        return self._search_read(gsi_domain, fields, limit, segments, max_workers, order, cursor)
 
     @classmethod
-    def _search_read(cls, gsi_domain=None, fields=None, limit=None):
+    def _search_read(cls, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None, order=None,
+                     cursor=None):
+        records = cls._search(gsi_domain, fields, limit, segments, max_workers, order, cursor)
+        # without the index keys and attributes the search needed
+        page = Page(projected([record.to_dict() for record in records], fields))
+        page.cursor = records.cursor
+        return page
+
+    @instrument
+    def search_count(self, gsi_domain=None, segments=None, max_workers=None):
+        return self._search_count(gsi_domain, segments, max_workers)
+
+    @classmethod
+    def _search_count(cls, gsi_domain=None, segments=None, max_workers=None):
+        # Select=COUNT when DynamoDB evaluates the whole domain, otherwise
+        # only the ids and the attributes checked in memory are read
         try:
-            cls._table = bootstrap(
-                cls._name,
-                cls._fields,
-                cls._billing_mode
-            ) if cls._name else None
-            TableName = cls._name
-
-            ProjectionExpression = ''
-            ExpressionAttributeNames = {}
-            ExpressionAttributeValues = {}
-
-            AttributeDefinitionsList = list(
-                filter(
-                    lambda filteredAttribute:
-                        'password' not in filteredAttribute and 'secret' not in filteredAttribute,
-                    map(
-                        lambda attribute: attribute.get('AttributeName'),
-                        cls._table.meta.data.get('AttributeDefinitions')
-                    )
+            searchPlan = cls._search_plan(gsi_domain, ['id'])
+            if not searchPlan.residual and not searchPlan.fetch:
+                return cls._store().count(
+                    cls, searchPlan, segments or cls._scan_segments, max_workers or cls._max_workers
                 )
-            )
-            if fields:
-                if 'id' not in fields:
-                    fields.append('id')
-                for key, field in enumerate(fields):
-                    if field in AttributeDefinitionsList:
-                        ExpressionAttributeNames[f'#{field}'] = field
-                        ProjectionExpression += f'#{field}, ' if key < len(
-                            fields) - 1 else f'#{field}'
-
-            if not gsi_domain:
-                scan_params = {
-                    'TableName': TableName,
-                    'Limit': cls._limit if not limit else limit,
-                    'ProjectionExpression': ProjectionExpression,
-                    'ExpressionAttributeNames': ExpressionAttributeNames
-                }
-                response = cls._table.scan(**scan_params)
-                items = response.get('Items', [])
-                results = []
-                for item in items:
-                    instance = cls()
-                    for key, value in item.items():
-                        setattr(instance, key, value)
-                    results.append(instance.__dict__)
-                return results
-
-            for domain in gsi_domain:
-                if domain[0] not in AttributeDefinitionsList:
-                    raise Exception(f'{domain[0]} is not an index field')
-                ExpressionAttributeNames[f'#{domain[0]}'] = f'{domain[0]}'
-                ExpressionAttributeValues[f':{domain[0]}'] = domain[2]
-
-            IndexName = f'{gsi_domain[0][0]}Index'
-            KeyConditionExpression = f'#{gsi_domain[0][0]} {gsi_domain[0][1]} :{gsi_domain[0][0]}'
-
-            query_params = {
-                'TableName': TableName,
-                'IndexName': IndexName,
-                'KeyConditionExpression': KeyConditionExpression,
-                'ExpressionAttributeNames': ExpressionAttributeNames,
-                'ExpressionAttributeValues': ExpressionAttributeValues,
-                'Limit': cls._limit if not limit else limit,
-            }
-            response = cls._table.query(**query_params)
-            items = response.get('Items', [])
-            results = []
-            for item in items:
-                instance = cls()
-                for key, value in item.items():
-                    setattr(instance, key, value)
-                results.append(instance)
-            return results
         except Exception as e:
             raise Exception(e)
+        return sum(len(items) for items in cls._search_pages(gsi_domain, ['id'], None, segments, max_workers))
+
+    @instrument
+    def read_group(self, gsi_domain=None, fields=None, groupby=None, offset=0, limit=None, orderby=None,
+                   segments=None, max_workers=None):
+        # Like Odoo's read_group: one row per distinct value of the groupby
+        # fields with its '__count' and the aggregates of `fields`, given as
+        # 'amount:sum' or 'total:sum(amount)' (count, sum, min, max, avg).
+        return self._read_group(gsi_domain, fields, groupby, offset, limit, orderby, segments, max_workers)
+
+    @classmethod
+    def _read_group(cls, gsi_domain=None, fields=None, groupby=None, offset=0, limit=None, orderby=None,
+                    segments=None, max_workers=None):
+        groupby = [groupby] if isinstance(groupby, str) else list(groupby or [])
+        specs = parse_fields(fields)
+        # only the grouped and aggregated attributes are read
+        needed = list(dict.fromkeys(groupby + [field for _, _, field in specs])) or ['id']
+        existingFields = list(map(lambda field: field.get('name'), cls._fields)) + defaultFields
+        for field in needed:
+            if field not in existingFields:
+                raise Exception(f'{field} is not a valid field')
+        groups = Groups(groupby, specs)
+        for items in cls._search_pages(gsi_domain, needed, None, segments, max_workers):
+            groups.add(items)
+        return groups.rows(orderby, offset, limit)
+
+    def changed_since(self, timestamp=None, fields=None, lag=LAG, max_workers=None):
+        # Records created or updated after `timestamp` (epoch seconds, None
+        # for all of them) in updatedAt order when the model has a
+        # `_change_bucket`, streamed as the set is iterated. Its `watermark`
+        # is the timestamp to pass to the next sync: changes of the last
+        # `lag` seconds may not be in the index yet and are left to it.
+        since = Decimal(str(timestamp or 0))
+        watermark = now() - lag
+        # one BETWEEN on the index's range key, the changes at `since`
+        # itself, already synced, are dropped in memory
+        gsi_domain = [('updatedAt', 'between', [since, watermark]), ('updatedAt', '>', since)]
+        order = None
+        if self._change_bucket:
+            buckets = bucket_keys(self, since, watermark, MAX_IN_VALUES)
+            # a sync far behind scans the table instead
+            if buckets:
+                gsi_domain = [(BUCKET, 'in', buckets)] + gsi_domain
+                order = 'updatedAt'
+        records = RecordSet(self._name, trace(
+            self, 'changed_since', self._iter_search(gsi_domain, fields, None, None, max_workers, order)
+        ))
+        records.watermark = watermark
+        return records
+
+    @instrument
+    def import_records(self, source, format=None, max_workers=None):
+        # Streams the items of a JSONL/CSV file or an iterable of dicts into
+        # the table with parallel batch writers. Items keep their id if they
+        # have one. Returns the number of records imported.
+        count = import_items(
+            self, read_items(source, format), defaultFields, now(), max_workers or self._max_workers
+        )
+        self.clear_cache()
+        return count
+
+    @instrument
+    def export_records(self, path, gsi_domain=None, fields=None, format=None, segments=None, max_workers=None):
+        # Streams the records matching the domain, all by default, to a
+        # JSONL/CSV file with a parallel segmented scan. Returns their number.
+        columns = defaultFields + list(map(lambda field: field.get('name'), self._fields))
+        if fields:
+            # the id always, importing the file back updates the same records
+            columns = ['id'] + [name for name in fields if name != 'id']
+        pages = self._search_pages(
+            gsi_domain, fields, None, segments or max(self._scan_segments, EXPORT_SEGMENTS), max_workers
+        )
+        return export_items(self, pages, path, columns, format)
+
+    async def acreate(self, values):
+        return await Async.run(self, self.create, values)
+
+    async def aread(self, IDs=None, fields=None):
+        return await Async.run(self, self.read, IDs, fields)
+
+    async def awrite(self, values, returning=False):
+        return await Async.run(self, self.write, values, returning)
+
+    async def adelete(self, ids=None):
+        return await Async.run(self, self.delete, ids)
+
+    async def asearch(self, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None, order=None,
+                      cursor=None):
+        return await Async.run(
+            self, self.search, gsi_domain, fields, limit, False, segments, max_workers, order, cursor
+        )
+
+    async def asearch_read(self, gsi_domain=None, fields=None, limit=_limit, segments=None, max_workers=None,
+                           order=None, cursor=None):
+        return await Async.run(
+            self, self.search_read, gsi_domain, fields, limit, False, segments, max_workers, order, cursor
+        )
+
+    async def asearch_count(self, gsi_domain=None, segments=None, max_workers=None):
+        return await Async.run(self, self.search_count, gsi_domain, segments, max_workers)
+
+    async def aread_group(self, gsi_domain=None, fields=None, groupby=None, offset=0, limit=None, orderby=None,
+                          segments=None, max_workers=None):
+        return await Async.run(
+            self, self.read_group, gsi_domain, fields, groupby, offset, limit, orderby, segments, max_workers
+        )
+
+    async def asearch_pages(self, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None,
+                            order=None, cursor=None):
+        # async iteration over every page, each one fetched when reached
+        pages = self.search_pages(gsi_domain, fields, limit, segments, max_workers, order, cursor)
+        async for page in Async.iterate(self, pages):
+            yield page
+
+    async def asearch_iter(self, gsi_domain=None, fields=None, limit=None, segments=None, max_workers=None,
+                           order=None, cursor=None):
+        async for page in self.asearch_pages(gsi_domain, fields, limit, segments, max_workers, order, cursor):
+            for record in page:
+                yield record
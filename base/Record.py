@@ -0,0 +1,195 @@
+import keyword
+
+from base.Metrics import instrument
+from base.Relation import Many2one, One2many
+from base.Changes import BUCKET
+from base.Compress import Packed, packed
+from base.Shard import attribute, sharded
+
+# Records returned by read/search are instances of a slotted class generated
+# per model from `_fields` and the default fields, instead of full Model
+# instances with a __dict__ each. Attributes that are not declared fields
+# (e.g. legacy data) are kept in a small `_extra` dict. Relational fields are
+# descriptors over the slots (see base.Relation). Records read with `fields`
+# are partial: the first access to a field they lack fetches the whole items
+# of every partial record of their prefetch group in one batch. Compressed
+# fields are descriptors too, unpacking on first access (see base.Compress).
+
+
+class Record:
+    __slots__ = ('_extra', '_prefetch', '_partial')
+    _model = None
+    _attributes = ()
+    # the slot holding each attribute, '_<name>' for many2one fields
+    _slots = ()
+    # stored attributes that aren't fields, e.g. the shard keys of sharded
+    # indexes, kept out of to_dict()
+    _hidden = ()
+    # the compressed fields
+    _packed = ()
+
+    def __init__(self, **values):
+        self._extra = None
+        self._set_values(values)
+
+    @classmethod
+    def from_item(cls, item):
+        return cls.from_items([item])[0]
+
+    @classmethod
+    def from_items(cls, items):
+        # replaced by the constructor compiled in record_class()
+        return [cls(**item) for item in items]
+
+    def _set_values(self, item):
+        # sets what was read, in memory only, write() persists changes
+        for key, value in item.items():
+            if key in self._attributes or key in self._hidden:
+                setattr(self, key, value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[key] = value
+        return self
+
+    def __getattr__(self, name):
+        # only called for unset slots and attributes that aren't slots
+        if name == '_extra':
+            raise AttributeError(name)
+        if name == '_prefetch':
+            return None
+        if name == '_partial':
+            return False
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        if name in self._attributes:
+            if self._loaded():
+                return getattr(self, name)
+            # declared fields missing from the item
+            return None
+        raise AttributeError(f'{type(self).__name__} has no attribute {name}')
+
+    def __repr__(self):
+        return f'<{self._model._name}({self.id})>'
+
+    def _values(self):
+        # the attributes as read, compressed fields still packed
+        values = {}
+        for name, slot in zip(self._attributes, self._slots):
+            try:
+                values[name] = object.__getattribute__(self, slot)
+            except AttributeError:
+                continue
+        if self._extra:
+            values.update(self._extra)
+        return values
+
+    def to_dict(self):
+        values = self._values()
+        for name in self._packed:
+            if name in values:
+                values[name] = getattr(self, name)
+        return values
+
+    def _loaded(self):
+        # loads the fields a projection left out, False when it left none
+        if not self._partial:
+            return False
+        self._load()
+        return True
+
+    def _load(self):
+        records = [
+            record for record in (self._prefetch.records if self._prefetch else [self])
+            if record._partial and record._model is self._model
+        ]
+        for record in records:
+            record._partial = False
+        items = {item.get('id'): item for item in self._model._items([record.id for record in records])}
+        for record in records:
+            loaded = record._values()
+            record._set_values({key: value for key, value in items.get(record.id, {}).items() if key not in loaded})
+
+    @instrument
+    def read(self, fields=None):
+        return self._model._read([self.id], fields)
+
+    @instrument
+    def write(self, values, returning=False):
+        result = self._model._write(dict(values, id=self.id), True)
+        self._set_values(result)
+        return result if returning else True
+
+    @instrument
+    def delete(self):
+        return self._model._delete([self.id])
+
+
+def record_class(model, defaultFields):
+    names = []
+    fields = {field.get('name'): field for field in model._fields or []}
+    for name in list(defaultFields) + list(fields):
+        # names that aren't identifiers or would shadow the record API go
+        # to _extra, one2many fields aren't stored
+        if name.isidentifier() and not keyword.iskeyword(name) and not hasattr(Record, name) \
+                and name not in names and fields.get(name, {}).get('type') != 'one2many':
+            names.append(name)
+    compressed = packed(model._fields)
+    slots = [
+        f'_{name}' if fields.get(name, {}).get('type') == 'many2one' or name in compressed else name
+        for name in names
+    ]
+    hidden = [attribute(name) for name in sharded(model._fields) if attribute(name) not in names]
+    if model._change_bucket and BUCKET not in names:
+        hidden.append(BUCKET)
+    cls = type(f'{model.__name__}Record', (Record,), {
+        '__slots__': tuple(slots + hidden),
+        '_model': model,
+        '_attributes': tuple(names),
+        '_slots': tuple(slots),
+        '_hidden': tuple(hidden),
+        '_packed': tuple(name for name in names if name in compressed),
+    })
+    for name, field in fields.items():
+        if field.get('type') == 'many2one' and name in names:
+            setattr(cls, name, Many2one(field, cls.__dict__[f'_{name}']))
+        elif name in compressed and name in names:
+            setattr(cls, name, Packed(field, cls.__dict__[f'_{name}']))
+        elif field.get('type') == 'one2many' and name.isidentifier() and not hasattr(Record, name):
+            setattr(cls, name, One2many(field))
+    cls.from_items = classmethod(_compile_constructor(names + hidden, slots + hidden))
+    return cls
+
+
+def _compile_constructor(names, slots):
+    # Generates a bulk constructor unrolled over the record's attributes,
+    # which beats a generic loop over each item's keys. Attributes missing
+    # from an item are left unset.
+    lines = [
+        'def from_items(cls, items):',
+        '    records = []',
+        '    stored = cls._attributes + cls._hidden',
+        '    append = records.append',
+        '    for item in items:',
+        '        record = new(cls)',
+        '        get = item.get',
+        '        found = 0',
+    ]
+    for name, slot in zip(names, slots):
+        lines += [
+            f'        value = get({name!r}, MISSING)',
+            '        if value is not MISSING:',
+            f'            record.{slot} = value',
+            '            found += 1',
+        ]
+    lines += [
+        '        if found == len(item):',
+        '            record._extra = None',
+        '        else:',
+        '            record._extra = {key: value for key, value in item.items() if key not in stored}',
+        '        append(record)',
+        '    return records',
+    ]
+    namespace = {'new': object.__new__, 'MISSING': object()}
+    exec('\n'.join(lines), namespace)
+    return namespace['from_items']
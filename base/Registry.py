@@ -0,0 +1,248 @@
+import threading
+import time
+
+import dynamo
+from base import Changes, Shard
+from base.Throttle import limiter
+
+
+def _attribute_type(name, fields):
+    for field in fields:
+        if field.get('name') == name:
+            # many2one fields hold the related id
+            return 'S' if field.get('type') == 'many2one' else field.get('type')
+    return 'N' if name in Changes.TIMESTAMPS else 'S'
+
+
+def index_definitions(fields, indexes=None):
+    # GSIs declared by the model: one '<field>Index' per `index` field, with an
+    # optional 'range' key and 'projection' ('ALL', 'KEYS_ONLY' or 'INCLUDE'
+    # with the 'include' attributes) or a '<field>ShardedIndex' with
+    # 'shards', plus the named ones from `indexes`
+    declared = []
+    for field in filter(lambda field: field.get('index'), fields):
+        if field.get('shards'):
+            # hashed on the '<field>Shard' attribute, see base.Shard
+            declared.append(dict(
+                field, hash=Shard.attribute(field.get('name')), name=f'{field.get("name")}ShardedIndex'
+            ))
+        else:
+            declared.append(dict(field, hash=field.get('name'), name=f'{field.get("name")}Index'))
+    declared += indexes or []
+
+    AttributeDefinitions = {}
+    GlobalSecondaryIndexes = []
+    for index in declared:
+        KeySchema = [{'AttributeName': index.get('hash'), 'KeyType': 'HASH'}]
+        if index.get('range'):
+            KeySchema.append({'AttributeName': index.get('range'), 'KeyType': 'RANGE'})
+        for key in KeySchema:
+            AttributeDefinitions[key['AttributeName']] = _attribute_type(key['AttributeName'], fields)
+        Projection = {'ProjectionType': index.get('projection', 'ALL')}
+        if Projection['ProjectionType'] == 'INCLUDE':
+            Projection['NonKeyAttributes'] = index.get('include', [])
+        GlobalSecondaryIndexes.append({
+            'IndexName': index.get('name'),
+            'KeySchema': KeySchema,
+            'Projection': Projection,
+        })
+    return AttributeDefinitions, GlobalSecondaryIndexes
+
+
+def _wait_for_index(table, IndexName=None, delay=5):
+    # waits for one index, or every index when no name is given, to be ACTIVE
+    while True:
+        table.reload()
+        building = [
+            index.get('IndexName') for index in table.global_secondary_indexes or []
+            if index.get('IndexStatus') != 'ACTIVE'
+        ]
+        if not building or (IndexName and IndexName not in building):
+            return
+        time.sleep(delay)
+
+
+def bootstrap(name, fields, billing_mode='PAY_PER_REQUEST', indexes=None, wait=True, capacity=None):
+    # Creates the table or its missing GSIs. DynamoDB builds one new GSI at a
+    # time, so with wait=False at most one index is requested per call.
+    # PROVISIONED tables and their GSIs get `capacity` ({'read': .., 'write':
+    # ..}) units.
+    from botocore.exceptions import ClientError
+
+    AttributeDefinitions, GlobalSecondaryIndexes = index_definitions(fields, indexes)
+    ProvisionedThroughput = {}
+    if billing_mode == 'PROVISIONED':
+        capacity = capacity or {}
+        ProvisionedThroughput = {'ProvisionedThroughput': {
+            'ReadCapacityUnits': capacity.get('read', 5),
+            'WriteCapacityUnits': capacity.get('write', 5),
+        }}
+        GlobalSecondaryIndexes = [dict(index, **ProvisionedThroughput) for index in GlobalSecondaryIndexes]
+    try:
+        table = dynamo.resource.Table(name)
+        existingIndexes = list(map(lambda index: index.get('IndexName'), table.global_secondary_indexes or []))
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ResourceNotFoundException':
+            raise Exception(e)
+        try:
+            table = dynamo.resource.create_table(
+                TableName=name,
+                KeySchema=[
+                    {
+                        'AttributeName': 'id',
+                        'KeyType': 'HASH'
+                    }
+                ],
+                BillingMode=billing_mode,
+                AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}] + [
+                    {'AttributeName': attribute, 'AttributeType': attributeType}
+                    for attribute, attributeType in AttributeDefinitions.items() if attribute != 'id'
+                ],
+                **({'GlobalSecondaryIndexes': GlobalSecondaryIndexes} if GlobalSecondaryIndexes else {}),
+                **ProvisionedThroughput
+            )
+            table.wait_until_exists()
+            return table
+        except Exception as e:
+            raise Exception(e)
+
+    try:
+        missingIndexes = list(filter(lambda index: index['IndexName'] not in existingIndexes, GlobalSecondaryIndexes))
+        building = any(index.get('IndexStatus') != 'ACTIVE' for index in table.global_secondary_indexes or [])
+        if missingIndexes and building and not wait:
+            return table
+        for index in missingIndexes:
+            if building:
+                _wait_for_index(table)
+            table.update(
+                AttributeDefinitions=[
+                    {'AttributeName': key['AttributeName'], 'AttributeType': AttributeDefinitions[key['AttributeName']]}
+                    for key in index['KeySchema']
+                ],
+                GlobalSecondaryIndexUpdates=[{'Create': index}],
+            )
+            if not wait:
+                break
+            _wait_for_index(table, index['IndexName'])
+            building = False
+        if missingIndexes:
+            table.reload()
+        return table
+    except Exception as e:
+        raise Exception(e)
+
+
+class Schema:
+    # Everything the ORM needs to know about a table, resolved once per process.
+    # `data` is a DescribeTable result, the table's own by default.
+    def __init__(self, name, table, data=None):
+        self.name = name
+        self.table = table
+        data = data or table.meta.data or {}
+        self.attributes = {
+            attribute.get('AttributeName'): attribute.get('AttributeType')
+            for attribute in data.get('AttributeDefinitions', [])
+        }
+        self.key_schema = {
+            key.get('KeyType'): key.get('AttributeName')
+            for key in data.get('KeySchema', [])
+        }
+        self.indexes = {}
+        for index in data.get('GlobalSecondaryIndexes', []) or []:
+            self.indexes[index.get('IndexName')] = {
+                'keys': {
+                    key.get('KeyType'): key.get('AttributeName')
+                    for key in index.get('KeySchema', [])
+                },
+                'projection': index.get('Projection', {}),
+                'status': index.get('IndexStatus'),
+            }
+        # provisioned read/write units of the table (None) and its GSIs
+        self.capacity = {}
+        if data.get('BillingModeSummary', {}).get('BillingMode') != 'PAY_PER_REQUEST':
+            for IndexName, description in [(None, data)] + [
+                (index.get('IndexName'), index) for index in data.get('GlobalSecondaryIndexes', []) or []
+            ]:
+                throughput = description.get('ProvisionedThroughput') or {}
+                if throughput.get('ReadCapacityUnits') or throughput.get('WriteCapacityUnits'):
+                    self.capacity[IndexName] = {
+                        'read': throughput.get('ReadCapacityUnits', 0),
+                        'write': throughput.get('WriteCapacityUnits', 0),
+                    }
+
+    def indexes_for(self, field):
+        # queryable (ACTIVE) indexes hashed on field
+        return [
+            name for name, index in self.indexes.items()
+            if index['keys'].get('HASH') == field and index['status'] in (None, 'ACTIVE')
+        ]
+
+    def covers(self, IndexName, fields):
+        # whether querying the index returns all of fields (None meaning the
+        # whole item) without going back to the table
+        projection = self.indexes[IndexName]['projection']
+        if projection.get('ProjectionType', 'ALL') == 'ALL':
+            return True
+        if fields is None:
+            return False
+        projected = set(self.indexes[IndexName]['keys'].values()) | set(self.key_schema.values())
+        projected |= set(projection.get('NonKeyAttributes', []))
+        return set(fields) <= projected
+
+
+class Registry:
+    # Per-process cache of table handles and schema metadata. In a warm Lambda
+    # container each model pays for DescribeTable at most once.
+    def __init__(self):
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, model):
+        schema = self._schemas.get(model._name)
+        if schema:
+            return schema
+        with self._lock:
+            schema = self._schemas.get(model._name)
+            if not schema:
+                if not model._name:
+                    raise Exception('Model has no table name')
+                if model._auto_migrate:
+                    table = bootstrap(
+                        model._name, model._fields, model._billing_mode, Changes.indexes(model), False, model._capacity
+                    )
+                else:
+                    table = dynamo.resource.Table(model._name)
+                    table.load()
+                schema = Schema(model._name, table)
+                limiter.register(schema)
+                self._schemas[model._name] = schema
+            return schema
+
+    def migrate(self, *models):
+        # Create missing tables and GSIs, then refresh the cached schemas.
+        # Meant to run from a deploy step rather than the request path.
+        schemas = []
+        for model in models:
+            table = bootstrap(
+                model._name, model._fields, model._billing_mode, Changes.indexes(model), True, model._capacity
+            )
+            with self._lock:
+                schema = Schema(model._name, table)
+                limiter.register(schema)
+                self._schemas[model._name] = schema
+            schemas.append(schema)
+        return schemas
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name:
+                self._schemas.pop(name, None)
+            else:
+                self._schemas.clear()
+
+
+registry = Registry()
+
+
+def migrate(*models):
+    return registry.migrate(*models)
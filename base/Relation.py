@@ -0,0 +1,150 @@
+from base.Batch import BATCH_GET_SIZE, chunks, parallel
+
+# Odoo like relational fields. A 'many2one' field stores the id of a record of
+# its 'comodel' (an 'S' attribute), a 'one2many' field stores nothing and
+# lists the comodel's records whose 'inverse' many2one points back:
+#
+#   {'name': 'customer', 'type': 'many2one', 'comodel': 'userWassallyTable', 'index': True}
+#   {'name': 'orders', 'type': 'one2many', 'comodel': 'wassallyOrder', 'inverse': 'customer'}
+#
+# Records loaded together (a read, a search page, a RecordSet) share a
+# Prefetch group. The first access to a relation on any of them fetches it
+# for the whole group, with chunked batch_get_item for many2one and one
+# query per distinct id (or a filtered scan without index) for one2many,
+# and the results are kept on the group.
+
+# model _name -> model class, filled by Model subclasses
+models = {}
+
+
+def comodel_of(field):
+    comodel = field.get('comodel')
+    if isinstance(comodel, str):
+        if comodel not in models:
+            raise Exception(f'Unknown model {comodel} of field {field.get("name")}')
+        return models[comodel]
+    return comodel
+
+
+class Prefetch:
+    __slots__ = ('records', 'cache')
+
+    def __init__(self, records):
+        self.records = records
+        # field name -> id -> related record(s)
+        self.cache = {}
+
+
+def group(records):
+    # makes records prefetch their relations together
+    prefetch = Prefetch(records)
+    for record in records:
+        record._prefetch = prefetch
+    return records
+
+
+def value_of(record, name):
+    # the stored value of a field, the id for many2one fields
+    attribute = getattr(type(record), name, None)
+    if isinstance(attribute, Many2one):
+        return attribute.id_of(record)
+    if isinstance(attribute, One2many):
+        return None
+    return getattr(record, name, None)
+
+
+def stored_values(model, values):
+    # related records given to create/write are stored as their id
+    for field in model._fields or []:
+        name = field.get('name')
+        if name not in values:
+            continue
+        if field.get('type') == 'one2many':
+            raise Exception(f'{name} is a one2many field, write its inverse {field.get("inverse")} instead')
+        if field.get('type') == 'many2one' and hasattr(values[name], '_model'):
+            values[name] = values[name].id
+    return values
+
+
+class Many2one:
+    # the related record on access, the raw id lives in the slot
+    def __init__(self, field, slot):
+        self.field = field
+        self.name = field.get('name')
+        self.slot = slot
+
+    def id_of(self, record):
+        try:
+            return self.slot.__get__(record)
+        except AttributeError:
+            return self.id_of(record) if record._loaded() else None
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        ID = self.id_of(record)
+        if ID is None:
+            return None
+        prefetch = record._prefetch or Prefetch([record])
+        related = prefetch.cache.setdefault(self.name, {})
+        if ID not in related:
+            ids = [
+                ID for ID in dict.fromkeys(map(self.id_of, prefetch.records))
+                if ID is not None and ID not in related
+            ]
+            found = group(comodel_of(self.field)._read(ids)) if ids else []
+            # dangling ids are cached as None too
+            related.update(dict.fromkeys(ids))
+            related.update({record.id: record for record in found})
+        return related.get(ID)
+
+    def __set__(self, record, value):
+        self.slot.__set__(record, value.id if hasattr(value, '_model') else value)
+
+
+class One2many:
+    def __init__(self, field):
+        self.field = field
+        self.name = field.get('name')
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        from base.Model import RecordSet
+
+        prefetch = record._prefetch or Prefetch([record])
+        related = prefetch.cache.setdefault(self.name, {})
+        if record.id not in related:
+            ids = [ID for ID in dict.fromkeys(record.id for record in prefetch.records) if ID not in related]
+            comodel = comodel_of(self.field)
+            children = {ID: [] for ID in ids}
+            for child in _children(comodel, self.field.get('inverse'), ids):
+                children.setdefault(value_of(child, self.field.get('inverse')), []).append(child)
+            for ID in ids:
+                related[ID] = RecordSet(comodel._name, children[ID])
+            # the children of every record prefetch together in turn, and
+            # already know their parents
+            prefetched = group([child for ID in ids for child in children[ID]])
+            if prefetched:
+                parents = {record.id: record for record in prefetch.records if record.id in children}
+                prefetched[0]._prefetch.cache[self.field.get('inverse')] = parents
+        return related[record.id]
+
+    def __set__(self, record, value):
+        raise AttributeError(f'{self.name} is a one2many field, write its inverse {self.field.get("inverse")} instead')
+
+
+def _children(comodel, inverse, ids):
+    # records of comodel whose inverse is one of ids
+    if comodel._schema().indexes_for(inverse):
+        pages = parallel(
+            lambda ID: [item for page in comodel._search_pages([(inverse, '=', ID)]) for item in page],
+            ids, comodel._max_workers,
+        )
+    else:
+        # IN takes up to 100 values
+        pages = [
+            [item for page in comodel._search_pages([(inverse, 'in', chunk)]) for item in page]
+            for chunk in chunks(ids, BATCH_GET_SIZE)
+        ]
+    return comodel._hydrate_many([item for page in pages for item in page])
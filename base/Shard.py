@@ -0,0 +1,49 @@
+import zlib
+
+# Write sharded GSIs for hot, low cardinality index fields. With
+#
+#   {'name': 'status', 'type': 'S', 'index': True, 'shards': 8}
+#
+# records also store 'statusShard' = '<status>#<shard>', the shard derived
+# from the id so a record keeps it across updates, and the field's index
+# ('statusShardedIndex') is hashed on it instead of on 'status'. Writes of
+# one status spread over 8 GSI partitions, and a search on status queries
+# every shard in parallel and merges the results.
+
+SUFFIX = 'Shard'
+
+
+def attribute(name):
+    return f'{name}{SUFFIX}'
+
+
+def sharded(fields):
+    # field name -> number of shards, for the sharded index fields
+    return {
+        field.get('name'): field.get('shards')
+        for field in fields or [] if field.get('index') and field.get('shards')
+    }
+
+
+def shard_of(ID, shards):
+    # stable across processes, unlike hash()
+    return zlib.crc32(str(ID).encode()) % shards
+
+
+def key(value, shard):
+    return f'{value}#{shard}'
+
+
+def keys(value, shards):
+    return [key(value, shard) for shard in range(shards)]
+
+
+def shard_values(model, values):
+    # sets the shard attributes of the sharded fields among values, which
+    # hold the record's id
+    for name, shards in sharded(model._fields).items():
+        if name in values:
+            values[attribute(name)] = None if values[name] is None else key(
+                values[name], shard_of(values['id'], shards)
+            )
+    return values
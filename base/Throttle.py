@@ -0,0 +1,198 @@
+import threading
+import time
+
+# Client side rate limiting of provisioned tables, shared by every request of
+# the process. Each table and GSI gets a read and a write token bucket
+# refilled at a rate that starts at its provisioned capacity. Requests wait
+# while a bucket they use is in debt, then reserve their estimated cost (a
+# unit per written item, the last observed cost of a read) so concurrent
+# requests don't all pass on the same tokens. Once the response comes back
+# the reservation is settled against the capacity DynamoDB reports consumed
+# (ReturnConsumedCapacity=INDEXES). The rates adapt AIMD style: halved
+# whenever a request is throttled or a batch comes back with unprocessed
+# items, then growing back linearly towards the provisioned capacity while
+# requests succeed. Bulk jobs hold close to the provisioned throughput
+# instead of alternating between throttling and backing off.
+
+THROTTLING_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+READS = {'GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'}
+WRITES = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+
+# multiplicative decrease, additive increase (share of the ceiling regained
+# per second) and the lowest rate, in capacity units per second
+DECREASE = 0.5
+INCREASE = 0.05
+MINIMUM_RATE = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.ceiling = float(rate)
+        self.rate = float(rate)
+        # a second worth of capacity
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.throttles = 0
+        # capacity consumed by the last request, the estimate of the next read
+        self.cost = 1.0
+        self._updated = self._adjusted = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self, estimate=0):
+        # blocks while the bucket is in debt, then reserves `estimate` units
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens > 0:
+                    self.tokens -= estimate
+                    return estimate
+                delay = -self.tokens / self.rate
+            time.sleep(min(delay, 1))
+
+    def consume(self, units, reserved=0):
+        # charges what a request consumed, less what it reserved
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.burst, self.tokens - units + reserved)
+            self.cost = units
+            self.rate = min(self.ceiling, self.rate + self.ceiling * INCREASE * (now - self._adjusted))
+            self._adjusted = now
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(MINIMUM_RATE, self.rate * DECREASE)
+            self.tokens = min(self.tokens, 0)
+            self._adjusted = time.monotonic()
+
+    def stats(self):
+        return {'ceiling': self.ceiling, 'rate': self.rate, 'tokens': self.tokens, 'throttles': self.throttles}
+
+
+class Limiter:
+    def __init__(self):
+        # (TableName, IndexName or None, 'read' or 'write') -> TokenBucket
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, TableName, IndexName=None, read=None, write=None):
+        # sets (or with 0 removes) the capacity a table or index is held to
+        with self._lock:
+            for kind, rate in (('read', read), ('write', write)):
+                if rate is None:
+                    continue
+                if rate:
+                    self.buckets[(TableName, IndexName, kind)] = TokenBucket(rate)
+                else:
+                    self.buckets.pop((TableName, IndexName, kind), None)
+
+    def register(self, schema):
+        # limits the tables and indexes that have provisioned capacity
+        for IndexName, capacity in schema.capacity.items():
+            if (schema.name, IndexName, 'read') not in self.buckets:
+                self.configure(schema.name, IndexName, **capacity)
+
+    def stats(self):
+        return {
+            f'{TableName}{":" + IndexName if IndexName else ""}:{kind}': bucket.stats()
+            for (TableName, IndexName, kind), bucket in list(self.buckets.items())
+        }
+
+    def _buckets(self, operation, params):
+        # the buckets a request draws from
+        kind = 'read' if operation in READS else 'write' if operation in WRITES else None
+        if kind is None or not self.buckets:
+            return []
+        if operation in ('BatchGetItem', 'BatchWriteItem'):
+            tables = list(params.get('RequestItems', {}))
+        elif operation in ('TransactWriteItems', 'TransactGetItems'):
+            tables = [
+                request.get('TableName') for item in params.get('TransactItems', []) for request in item.values()
+            ]
+        else:
+            tables = [params.get('TableName')]
+        buckets = []
+        for TableName in dict.fromkeys(tables):
+            if kind == 'read':
+                keys = [(TableName, params.get('IndexName') if operation in ('Query', 'Scan') else None, kind)]
+            else:
+                # writes also consume the write capacity of every GSI
+                keys = [key for key in self.buckets if key[0] == TableName and key[2] == 'write']
+            buckets += [(key, self.buckets[key]) for key in keys if key in self.buckets]
+        return buckets
+
+
+limiter = Limiter()
+
+
+def _estimate(operation, params, key, bucket):
+    # the units a request is expected to consume from a bucket
+    TableName, _, kind = key
+    if kind == 'read':
+        return bucket.cost
+    if operation == 'BatchWriteItem':
+        return len(params.get('RequestItems', {}).get(TableName, []))
+    if operation == 'TransactWriteItems':
+        # transactional writes cost twice as much
+        requests = [request for item in params.get('TransactItems', []) for request in item.values()]
+        return 2 * sum(request.get('TableName') == TableName for request in requests)
+    return 1
+
+
+def _provide_params(params, model, context, **kwargs):
+    buckets = limiter._buckets(model.name, params)
+    if not buckets:
+        return
+    # per index consumption, also covers what ReturnConsumedCapacity=TOTAL gives
+    params['ReturnConsumedCapacity'] = 'INDEXES'
+    context['serverlessORM_buckets'] = buckets
+    context['serverlessORM_reserved'] = {
+        key: bucket.wait(_estimate(model.name, params, key, bucket)) for key, bucket in buckets
+    }
+
+
+def _after_call(parsed, model, context, **kwargs):
+    buckets = dict(context.get('serverlessORM_buckets') or [])
+    if not buckets:
+        return
+    kind = 'read' if model.name in READS else 'write'
+    capacity = parsed.get('ConsumedCapacity')
+    if capacity:
+        consumed = {}
+        for entry in [capacity] if isinstance(capacity, dict) else capacity:
+            TableName = entry.get('TableName')
+            table = entry.get('Table', {}).get('CapacityUnits', entry.get('CapacityUnits', 0))
+            consumed[(TableName, None, kind)] = float(table)
+            for IndexName, index in (entry.get('GlobalSecondaryIndexes') or {}).items():
+                consumed[(TableName, IndexName, kind)] = float(index.get('CapacityUnits', 0))
+        # the reservations are settled, a failed request keeps its own
+        reserved = context.get('serverlessORM_reserved') or {}
+        for key, bucket in buckets.items():
+            bucket.consume(consumed.get(key, 0.0), reserved.get(key, 0))
+    if parsed.get('UnprocessedKeys') or parsed.get('UnprocessedItems'):
+        # DynamoDB only leaves items unprocessed when short of capacity
+        for bucket in buckets.values():
+            bucket.throttled()
+
+
+def _needs_retry(response=None, request_dict=None, **kwargs):
+    if not response or not request_dict:
+        return None
+    buckets = (request_dict.get('context') or {}).get('serverlessORM_buckets')
+    if buckets and response[1].get('Error', {}).get('Code') in THROTTLING_ERRORS:
+        for _, bucket in buckets:
+            bucket.throttled()
+    return None
+
+
+def attach(client):
+    # called by dynamo for every client it builds
+    client.meta.events.register('provide-client-params.dynamodb', _provide_params)
+    client.meta.events.register('after-call.dynamodb', _after_call)
+    client.meta.events.register('needs-retry.dynamodb', _needs_retry)
+    return client
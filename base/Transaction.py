@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from base.Metrics import measured
+
+# A unit of work: within `with transaction():` creates, writes and deletes of
+# any model are queued instead of sent, repeated changes to the same record
+# are coalesced into one, and everything is flushed when the block exits, in
+# as few BatchWriteItem requests as possible, or as a single
+# TransactWriteItems with atomic=True. Nothing is written if the block
+# raises. Reads within the block don't see the queued changes.
+
+
+class UnitOfWork:
+    _name = 'transaction'
+
+    def __init__(self, atomic=False):
+        self.atomic = atomic
+        # (model, id) -> [kind, payload], kind being 'put' (the item),
+        # 'update' (the values to set, None removing) or 'delete'
+        self.changes = {}
+        # run once everything is written
+        self.callbacks = []
+        self._lock = threading.Lock()
+
+    def put(self, model, item):
+        with self._lock:
+            self.changes[(model, item['id'])] = ['put', dict(item)]
+
+    def update(self, model, values):
+        key = (model, values['id'])
+        with self._lock:
+            change = self.changes.get(key)
+            if change is None:
+                self.changes[key] = ['update', dict(values)]
+            elif change[0] == 'delete':
+                raise Exception(f'{values["id"]} is deleted in this transaction')
+            elif change[0] == 'put':
+                # the record is created by this transaction, write it whole
+                for field, value in values.items():
+                    if value is None:
+                        change[1].pop(field, None)
+                    else:
+                        change[1][field] = value
+            else:
+                change[1].update(values)
+
+    def delete(self, model, ID):
+        with self._lock:
+            self.changes[(model, ID)] = ['delete', ID]
+
+    def on_commit(self, callback):
+        with self._lock:
+            self.callbacks.append(callback)
+
+    def commit(self):
+        return measured(self, 'commit', self._commit)
+
+    def _commit(self):
+        # one commit per backend, in the order the records were first changed
+        backends = {}
+        for (model, ID), (kind, payload) in self.changes.items():
+            backends.setdefault(model._store(), []).append((model, kind, payload))
+        if self.atomic and len(backends) > 1:
+            raise Exception('An atomic transaction can not span several backends')
+        for backend, changes in backends.items():
+            backend.commit(changes, self.atomic)
+        for model, ids in self._ids().items():
+            model._invalidate(ids)
+        self.changes.clear()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _ids(self):
+        ids = {}
+        for model, ID in self.changes:
+            ids.setdefault(model, []).append(ID)
+        return ids
+
+
+_unit = ContextVar('unit', default=None)
+
+
+def current():
+    return _unit.get()
+
+
+@contextmanager
+def transaction(atomic=False):
+    # nested blocks join the outermost one
+    unit = _unit.get()
+    if unit is not None:
+        unit.atomic = unit.atomic or atomic
+        yield unit
+        return
+    unit = UnitOfWork(atomic)
+    token = _unit.set(unit)
+    try:
+        yield unit
+    finally:
+        _unit.reset(token)
+    unit.commit()
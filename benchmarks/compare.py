@@ -0,0 +1,41 @@
+import json
+import sys
+
+# Compares two result files of benchmarks/orm.py and exits with 1 when any
+# operation got slower (p50) or makes more API calls than the threshold allows.
+#
+#   python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json [threshold]
+
+
+def load(path):
+    with open(path) as file:
+        report = json.load(file)
+    return report, {
+        (result['model'], result['operation'], result['size'], result['batch']): result
+        for result in report['results']
+    }
+
+
+def change(old, new):
+    return (new - old) / old if old else 0.0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        raise SystemExit('usage: compare.py OLD NEW [threshold]')
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    oldReport, old = load(sys.argv[1])
+    newReport, new = load(sys.argv[2])
+    print(f"{oldReport['commit']} -> {newReport['commit']}")
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=repr):
+        latency = change(old[key]['p50_ms'], new[key]['p50_ms'])
+        calls = change(old[key]['api_calls_per_call'], new[key]['api_calls_per_call'])
+        regressed = latency > threshold or calls > 0
+        regressions += regressed
+        print(
+            f"{'!' if regressed else ' '} {key[0]:<20} {key[1]:<20} size={key[2]:<6} batch={key[3]:<4} "
+            f"p50 {old[key]['p50_ms']:8.2f} -> {new[key]['p50_ms']:8.2f}ms ({latency:+.0%}) "
+            f"api/call {old[key]['api_calls_per_call']:.2f} -> {new[key]['api_calls_per_call']:.2f}"
+        )
+    sys.exit(1 if regressions else 0)
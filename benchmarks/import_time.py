@@ -0,0 +1,49 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the cold import cost of the package, i.e. what a Lambda cold start
+# pays before the handler runs, using `python -X importtime` in fresh
+# interpreters.
+#
+#   python benchmarks/import_time.py [module] [runs]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module):
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    for line in output.splitlines()[::-1]:
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise Exception(f'{module} not found in the importtime output')
+
+
+def first_connection_time():
+    # lazily building the session and resource on first use
+    code = (
+        'import time, dynamo; started = time.perf_counter(); dynamo.get_resource(); '
+        'print((time.perf_counter() - started) * 1000)'
+    )
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout)
+
+
+if __name__ == '__main__':
+    module = sys.argv[1] if len(sys.argv) > 1 else 'models'
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    imports = [import_time(module) for _ in range(runs)]
+    connections = [first_connection_time() for _ in range(runs)]
+    print(json.dumps({
+        'module': module,
+        'runs': runs,
+        'import_ms': {'median': statistics.median(imports), 'min': min(imports), 'max': max(imports)},
+        'first_resource_ms': {'median': statistics.median(connections), 'min': min(connections)},
+    }, indent=2))
@@ -0,0 +1,228 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+# Runs create/read/write/search/search_read/delete on the User and Order
+# models against a local DynamoDB stand-in and reports latency percentiles,
+# throughput and the number of AWS API calls per ORM call, as JSON under
+# benchmarks/results/<commit>.json (compare two runs with compare.py).
+#
+# By default DynamoDB is mocked in process by moto (pip install -r
+# benchmarks/requirements.txt), pass --endpoint-url to run against a local
+# server instead (DynamoDB Local or `moto_server`), or --backend memory for the
+# in-process engine of base.Memory.
+#
+#   python benchmarks/orm.py [--sizes 100,1000] [--batches 1,25,100] [--endpoint-url URL] [--backend memory]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# names are spread over this many values so that a search returns size / GROUPS
+GROUPS = 10
+
+
+class Calls:
+    # counts the API calls made by both of the package's clients
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def __call__(self, event_name, **kwargs):
+        with self._lock:
+            self.counts[event_name.rsplit('.', 1)[-1]] += 1
+
+    def attach(self, client):
+        client.meta.events.register('before-call.dynamodb', self)
+
+    def take(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def percentile(values, percent):
+    # nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+def measure(calls, function, arguments):
+    # one ORM call per argument, returns the latencies and the API calls made
+    latencies = []
+    calls.take()
+    started = time.perf_counter()
+    for argument in arguments:
+        begin = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - begin)
+    return latencies, time.perf_counter() - started, calls.take()
+
+
+def summary(model, operation, size, batch, items, latencies, elapsed, api_calls):
+    return {
+        'model': model._name,
+        'operation': operation,
+        'size': size,
+        'batch': batch,
+        'calls': len(latencies),
+        'items': items,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'calls_per_s': len(latencies) / elapsed,
+        'items_per_s': items / elapsed,
+        'api_calls_per_call': sum(api_calls.values()) / len(latencies),
+        'api_calls': dict(api_calls),
+    }
+
+
+def chunks(items, size):
+    return [items[index:index + size] for index in range(0, len(items), size)]
+
+
+def values_for(model, index):
+    values = {'name': f'name-{index % GROUPS}', 'email': f'user{index}@example.com'}
+    if any(field.get('name') == 'mobile' for field in model._fields):
+        values['mobile'] = f'+2010{index:08d}'
+    return values
+
+
+def scenario(model, size, batch, calls):
+    results = []
+    # resolving (and creating) the table is not part of any measurement
+    model._schema()
+
+    records = []
+    latencies, elapsed, api_calls = measure(
+        calls, lambda values: records.extend(model.create(values)),
+        chunks([values_for(model, index) for index in range(size)], batch),
+    )
+    results.append(summary(model, 'create', size, batch, size, latencies, elapsed, api_calls))
+    ids = [record.id for record in records]
+
+    latencies, elapsed, api_calls = measure(calls, model.read, chunks(ids, batch))
+    results.append(summary(model, 'read', size, batch, size, latencies, elapsed, api_calls))
+
+    latencies, elapsed, api_calls = measure(
+        calls, model.write, chunks([{'id': ID, 'email': f'changed{index}@example.com'} for index, ID in enumerate(ids)], batch),
+    )
+    results.append(summary(model, 'write', size, batch, size, latencies, elapsed, api_calls))
+
+    # an indexed equality (Query) and an unindexed filter (Scan), each over
+    # every group
+    for operation, search in (('search', model.search), ('search_read', model.search_read)):
+        for kind, domain in (('query', lambda group: [('name', '=', f'name-{group}')]),
+                             ('scan', lambda group: [('email', 'like', f'{group}@example.com')])):
+            found = []
+            latencies, elapsed, api_calls = measure(
+                calls, lambda group: found.append(len(search(domain(group), limit=size))), range(GROUPS),
+            )
+            results.append(summary(
+                model, f'{operation}:{kind}', size, batch, sum(found), latencies, elapsed, api_calls,
+            ))
+
+    latencies, elapsed, api_calls = measure(calls, model.delete, chunks(ids, batch))
+    results.append(summary(model, 'delete', size, batch, size, latencies, elapsed, api_calls))
+    return results
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def integers(value):
+    return [int(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=integers, default=[100, 1000])
+    parser.add_argument('--batches', type=integers, default=[1, 25, 100])
+    parser.add_argument('--models', default='users,orders')
+    parser.add_argument('--endpoint-url', default=None)
+    parser.add_argument('--backend', choices=['dynamodb', 'memory'], default='dynamodb')
+    parser.add_argument('--output', default=None)
+    arguments = parser.parse_args()
+
+    # the stand-ins accept any credentials
+    for variable, value in (('aws_access_key_id', 'benchmark'), ('aws_secret_access_key', 'benchmark'),
+                            ('region_name', 'us-east-1')):
+        os.environ.setdefault(variable, value)
+    if arguments.endpoint_url or arguments.backend == 'memory':
+        if arguments.endpoint_url:
+            os.environ['DYNAMO_ENDPOINT_URL'] = arguments.endpoint_url
+        mock = None
+    else:
+        try:
+            from moto import mock_dynamodb
+        except ImportError:
+            raise SystemExit('moto is required for the in-process stand-in: pip install -r benchmarks/requirements.txt')
+        mock = mock_dynamodb
+
+    import dynamo
+    import models
+    from base.Memory import MemoryBackend
+    from base.Model import Model
+    from base.Registry import registry
+
+    results = []
+    for name in arguments.models.split(','):
+        model = getattr(models, name)
+        for size in arguments.sizes:
+            for batch in arguments.batches:
+                if batch > size:
+                    continue
+                mocked = mock() if mock else None
+                if mocked:
+                    # a fresh backend, and clients bound to it
+                    mocked.start()
+                    dynamo.configure()
+                    registry.invalidate()
+                if arguments.backend == 'memory':
+                    Model._backend = MemoryBackend()
+                try:
+                    calls = Calls()
+                    if arguments.backend != 'memory':
+                        calls.attach(dynamo.resource.meta.client)
+                        calls.attach(dynamo.client)
+                    results += scenario(model, size, batch, calls)
+                finally:
+                    if mocked:
+                        mocked.stop()
+                print(f'{model._name} size={size} batch={batch} done', file=sys.stderr)
+
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    report = {
+        'commit': commit,
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'backend': arguments.endpoint_url or ('memory' if arguments.backend == 'memory' else 'moto'),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'results': results,
+    }
+    output = arguments.output or os.path.join(ROOT, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    for result in results:
+        print(
+            f"{result['model']:<20} {result['operation']:<20} size={result['size']:<6} batch={result['batch']:<4} "
+            f"p50={result['p50_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+            f"items/s={result['items_per_s']:9.0f} api/call={result['api_calls_per_call']:.2f}"
+        )
+    print(f'written to {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
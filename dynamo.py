@@ -1,10 +1,20 @@
 import os
-import boto3
+import threading
+
+# The session, client and resource are only built on first use, so importing
+# the package costs nothing on code paths that never touch DynamoDB. boto3 is
+# imported lazily as well, it is the bulk of the import time.
+
 
 def load_env_file(file_path):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     abs_file_path = os.path.join(script_dir, file_path)
 
+    # Lambda and most deployments configure credentials through the
+    # environment or an IAM role instead
+    if not os.path.exists(abs_file_path):
+        return
+
     with open(abs_file_path, 'r') as file:
         lines = file.readlines()
 
@@ -18,19 +28,127 @@ def load_env_file(file_path):
 # Specify the path to your environment file
 env_file_path = '.env'
 
-# Load the environment variables from the file
-load_env_file(env_file_path)
+# botocore.config.Config options, each one can be overridden through an
+# environment variable (e.g. DYNAMO_MAX_POOL_CONNECTIONS=50) or configure()
+config = {
+    'max_pool_connections': 32,
+    'tcp_keepalive': True,
+    'connect_timeout': 2,
+    'read_timeout': 5,
+    'retries': {'mode': 'standard', 'max_attempts': 5},
+}
+_environment = {
+    'max_pool_connections': ('DYNAMO_MAX_POOL_CONNECTIONS', int),
+    'tcp_keepalive': ('DYNAMO_TCP_KEEPALIVE', lambda value: value.lower() in ('1', 'true', 'yes')),
+    'connect_timeout': ('DYNAMO_CONNECT_TIMEOUT', float),
+    'read_timeout': ('DYNAMO_READ_TIMEOUT', float),
+}
+
+_lock = threading.RLock()
+_session = None
+_client = None
+_resource = None
+
+
+def configure(**options):
+    # changes the botocore Config of connections created from now on, call it
+    # before the first request (existing ones are dropped)
+    global _client, _resource
+    with _lock:
+        config.update(options)
+        _client = None
+        _resource = None
+
+
+def _config():
+    from botocore.config import Config
+
+    options = dict(config)
+    for option, (variable, cast) in _environment.items():
+        if os.environ.get(variable):
+            options[option] = cast(os.environ[variable])
+    retries = dict(options.get('retries') or {})
+    if os.environ.get('DYNAMO_RETRY_MODE'):
+        retries['mode'] = os.environ['DYNAMO_RETRY_MODE']
+    if os.environ.get('DYNAMO_MAX_ATTEMPTS'):
+        retries['max_attempts'] = int(os.environ['DYNAMO_MAX_ATTEMPTS'])
+    options['retries'] = retries
+    return Config(**options)
+
+
+def _endpoint_url():
+    # e.g. a DynamoDB Local server for development and benchmarks
+    return os.environ.get('DYNAMO_ENDPOINT_URL') or None
+
+
+def _attach(client):
+    # the ORM's botocore event handlers: metrics and rate limiting
+    from base import Metrics, Throttle
+
+    Metrics.attach(client)
+    Throttle.attach(client)
+    return client
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+
+                # Load the environment variables from the file
+                load_env_file(env_file_path)
+
+                # Access the environment variables
+                aws_access_key_id = os.environ.get('aws_access_key_id')
+                aws_secret_access_key = os.environ.get('aws_secret_access_key')
+                region_name = os.environ.get('region_name')
+
+                _session = boto3.Session(
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    region_name=region_name,
+                )
+    return _session
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _attach(get_session().client('dynamodb', config=_config(), endpoint_url=_endpoint_url()))
+    return _client
+
+
+def get_resource():
+    global _resource
+    if _resource is None:
+        with _lock:
+            if _resource is None:
+                _resource = get_session().resource('dynamodb', config=_config(), endpoint_url=_endpoint_url())
+                _attach(_resource.meta.client)
+    return _resource
+
 
-# Access the environment variables
-aws_access_key_id = os.environ.get('aws_access_key_id')
-aws_secret_access_key = os.environ.get('aws_secret_access_key')
-region_name = os.environ.get('region_name')
+def prewarm(*models):
+    # Call from the Lambda init phase (module level of the handler) to pay for
+    # credentials, endpoint resolution and the TLS handshake before the first
+    # invocation. Given models also get their schema resolved.
+    get_resource().meta.client.describe_endpoints()
+    get_client().describe_endpoints()
+    for model in models:
+        model._schema()
 
-session = boto3.Session(
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-    region_name=region_name,
-)
 
-client = session.client('dynamodb')
-resource = session.resource('dynamodb')
+def __getattr__(name):
+    # `dynamo.session`, `dynamo.client` and `dynamo.resource` keep working,
+    # built on first access
+    if name == 'session':
+        return get_session()
+    if name == 'client':
+        return get_client()
+    if name == 'resource':
+        return get_resource()
+    raise AttributeError(f'module {__name__} has no attribute {name}')
@@ -20,13 +20,13 @@ print(newUser.read())
 for user in newUsers:
     print(user.read()) #
 
-    # update method can be used with record directly
-    user.update({
+    # write method can be used with record directly
+    user.write({
         'name': 'Ragab'
     })
 
-# update method can also take multiple records with id and returns True if all records updated.
-# users.update([
+# write method can also take multiple records with id and returns True if all records updated.
+# users.write([
 #     {
 #         'id': id,
 #         'name': 'Mohammed'
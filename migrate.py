@@ -0,0 +1,6 @@
+from base.Registry import migrate
+from models import users, orders
+
+# create missing tables and GSIs ahead of time so requests never pay for it
+for schema in migrate(users, orders):
+    print(schema.name, list(schema.indexes))
@@ -0,0 +1,46 @@
+from decimal import Decimal
+
+import pytest
+
+from base.Memory import MemoryBackend
+from base.Model import Model
+
+
+class Profile(Model):
+    _name = 'test_bulk_profiles'
+    _backend = MemoryBackend()
+    _fields = [
+        {'name': 'name', 'type': 'S'},
+        {'name': 'age', 'type': 'N'},
+        {'name': 'tags', 'type': 'L'},
+        {'name': 'settings', 'type': 'M'},
+        {'name': 'active', 'type': 'BOOL'},
+    ]
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'csv'])
+def test_export_then_import_keeps_the_records(tmp_path, format):
+    Profile._backend.clear(Profile)
+    Profile().create([
+        {'name': 'a', 'age': 30, 'tags': ['x', 'y'], 'settings': {'theme': 'dark', 'size': 2}, 'active': True},
+        {'name': 'b', 'age': 41.5},
+    ])
+    before = {record.id: record.to_dict() for record in Profile().search(limit=100)}
+    path = str(tmp_path / f'profiles.{format}')
+    assert Profile().export_records(path) == 2
+
+    Profile._backend.clear(Profile)
+    assert Profile().import_records(path) == 2
+    after = {record.id: record.to_dict() for record in Profile().search(limit=100)}
+    assert after == before
+    assert {record['name']: record['age'] for record in after.values()} == {'a': Decimal('30'), 'b': Decimal('41.5')}
+
+
+
+def test_export_of_some_fields_keeps_the_id(tmp_path):
+    Profile._backend.clear(Profile)
+    record = Profile().create({'name': 'a', 'age': 30})[0]
+    path = str(tmp_path / 'names.csv')
+    Profile().export_records(path, fields=['name'])
+    with open(path) as file:
+        assert file.read().splitlines() == ['id,name', f'{record.id},a']
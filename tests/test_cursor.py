@@ -0,0 +1,62 @@
+import base.Backend
+from base.Backend import DynamoBackend
+from base.Memory import MemoryBackend
+from base.Model import Model
+
+
+class Note(Model):
+    _name = 'test_cursor_notes'
+    _backend = MemoryBackend()
+    _fields = [{'name': 'title', 'type': 'S'}, {'name': 'topic', 'type': 'S', 'index': True, 'range': 'rank'},
+               {'name': 'rank', 'type': 'N'}]
+
+
+def pages(model, domain, limit, order=None):
+    # the ids of every page, following the cursors
+    ids, cursor = [], None
+    while True:
+        records = model.search(domain, limit=limit, order=order, cursor=cursor)
+        ids.append([record.id for record in records])
+        cursor = records.cursor
+        if not cursor:
+            return ids
+
+
+def test_id_in_pages_follow_the_ids():
+    IDs = [record.id for record in Note().create([{'title': str(index)} for index in range(5)])]
+    assert pages(Note(), [('id', 'in', IDs)], 2) == [IDs[0:2], IDs[2:4], IDs[4:]]
+
+
+def test_query_pages_resume_after_the_last_record():
+    IDs = [record.id for record in Note().create([{'topic': 'a', 'rank': rank} for rank in range(7)])]
+    Note().create([{'topic': 'b', 'rank': rank} for rank in range(7)])
+    assert pages(Note(), [('topic', '=', 'a'), ('rank', '>', 1)], 3) == [IDs[2:5], IDs[5:7]]
+    assert pages(Note(), [('topic', '=', 'a')], 4, 'rank desc') == [IDs[:2:-1], IDs[2::-1]]
+
+
+class DynamoOnMemory(DynamoBackend):
+    # DynamoDB requests on the items of a MemoryBackend
+    def __init__(self, memory):
+        self.memory = memory
+
+    def schema(self, model):
+        return self.memory.schema(model)
+
+
+def test_id_in_pages_follow_the_ids_in_any_batch_get_order(monkeypatch):
+    memory = MemoryBackend()
+
+    class Shuffled(Model):
+        _name = 'test_cursor_shuffled'
+        _backend = memory
+        _fields = [{'name': 'title', 'type': 'S'}]
+
+    IDs = [record.id for record in Shuffled().create([{'title': str(index)} for index in range(5)])]
+    Shuffled._backend = DynamoOnMemory(memory)
+
+    def batch_get(name, keys, retries=8, max_workers=8, client=None, **params):
+        # batch_get_item makes no promise on the order of the items
+        return list(reversed(memory.get(Shuffled, [key['id'] for key in keys])))
+
+    monkeypatch.setattr(base.Backend, 'batch_get', batch_get)
+    assert pages(Shuffled(), [('id', 'in', IDs)], 2) == [IDs[0:2], IDs[2:4], IDs[4:]]
@@ -0,0 +1,56 @@
+from base.Memory import MemoryBackend
+from base.Model import Model
+
+
+class Order(Model):
+    _name = 'test_planner_orders'
+    _backend = MemoryBackend()
+    _fields = [
+        {'name': 'status', 'type': 'S', 'index': True, 'range': 'total', 'projection': 'KEYS_ONLY'},
+        {'name': 'customer', 'type': 'S', 'index': True},
+        {'name': 'total', 'type': 'N'},
+    ]
+
+
+def test_ids_are_read_by_key():
+    searchPlan = Order._search_plan([('id', 'in', ['a', 'b'])])
+    assert (searchPlan.kind, searchPlan.keys) == ('get', ['a', 'b'])
+
+
+def test_bounds_on_the_range_key_make_one_between():
+    searchPlan = Order._search_plan([('status', '=', 'open'), ('total', '>=', 10), ('total', '<=', 20)])
+    assert (searchPlan.kind, searchPlan.index) == ('query', 'statusIndex')
+    assert searchPlan.key_condition == '#d0 = :d0 AND #d1 BETWEEN :d1 AND :d2'
+    assert searchPlan.filter is None and searchPlan.residual is None
+
+
+def test_strict_bounds_are_checked_in_memory():
+    searchPlan = Order._search_plan([('status', '=', 'open'), ('total', '>', 10), ('total', '<', 20)])
+    assert searchPlan.range == ('term', 'total', 'between', [10, 20])
+    # DynamoDB takes no filter on a key attribute
+    assert searchPlan.filter is None
+    assert searchPlan.residual == ('&', ('term', 'total', '>', 10), ('term', 'total', '<', 20))
+
+
+def test_other_fields_are_filtered():
+    searchPlan = Order._search_plan([('customer', '=', 'c'), ('total', '>', 5)])
+    assert (searchPlan.index, searchPlan.filter, searchPlan.residual) == ('customerIndex', '#d1 > :d1', None)
+    assert not searchPlan.fetch
+
+
+def test_keys_only_index_fetches_the_items():
+    assert Order._search_plan([('status', '=', 'open')]).fetch
+
+
+def test_no_key_condition_scans():
+    searchPlan = Order._search_plan([('total', '>', 5)])
+    assert (searchPlan.kind, searchPlan.filter) == ('scan', '#d0 > :d0')
+
+
+def test_results_match_the_domain():
+    Order().create([
+        {'status': status, 'customer': 'c', 'total': total} for status in ('open', 'done') for total in range(30)
+    ])
+    domain = [('status', '=', 'open'), ('total', '>', 10), ('total', '<', 20)]
+    records = Order().search(domain, limit=100, order='total')
+    assert [(record.status, record.total) for record in records] == [('open', total) for total in range(11, 20)]
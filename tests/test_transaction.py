@@ -0,0 +1,52 @@
+from base.Memory import MemoryBackend
+from base.Model import Model
+from base.Transaction import current
+
+
+class Account(Model):
+    _name = 'test_transaction_accounts'
+    _backend = MemoryBackend()
+    _fields = [{'name': 'name', 'type': 'S'}, {'name': 'mobile', 'type': 'S'}]
+
+
+def commits(monkeypatch):
+    # the changes of every commit sent to the backend
+    sent = []
+    commit = Account._backend.commit
+    monkeypatch.setattr(Account._backend, 'commit', lambda changes, atomic=False: (
+        sent.append([(kind, payload) for _, kind, payload in changes]), commit(changes, atomic)
+    ))
+    return sent
+
+
+def test_writes_to_a_record_are_coalesced(monkeypatch):
+    account = Account().create({'name': 'a'})[0]
+    sent = commits(monkeypatch)
+    with Account.transaction():
+        Account().write({'id': account.id, 'mobile': '0100'})
+        Account().write({'id': account.id, 'name': 'b'})
+        assert len(current().changes) == 1
+    [[(kind, payload)]] = sent
+    assert kind == 'update' and payload.items() >= {'mobile': '0100', 'name': 'b'}.items()
+    assert Account().read([account.id])[0].to_dict().items() >= {'name': 'b', 'mobile': '0100'}.items()
+
+
+def test_writes_to_a_created_record_are_one_put(monkeypatch):
+    sent = commits(monkeypatch)
+    with Account.transaction():
+        account = Account().create({'name': 'a', 'mobile': '0100'})[0]
+        Account().write({'id': account.id, 'name': 'b', 'mobile': None})
+    assert [[(kind, payload.get('name'), 'mobile' in payload) for kind, payload in changes] for changes in sent] == [
+        [('put', 'b', False)]
+    ]
+
+
+def test_nothing_is_written_when_the_block_raises(monkeypatch):
+    sent = commits(monkeypatch)
+    try:
+        with Account.transaction():
+            Account().create({'name': 'a'})
+            raise ValueError
+    except ValueError:
+        pass
+    assert sent == []